@@ -0,0 +1,90 @@
+"""
+Measures what response compression saves and costs for each route.
+
+Fetches every route uncompressed from a running deployment, then compresses
+each body with every available encoding at its configured level (see
+src/compression.py) and reports the bytes saved and the CPU time spent per
+response. Bodies under the middleware's minimum size are listed but sent
+uncompressed.
+
+    python -m benchmarks.bench_compression --target http://localhost:3000
+    python -m benchmarks.bench_compression --target ... --level 1
+"""
+import argparse
+import time
+import urllib.request
+
+from src.compression import DEFAULT_LEVELS, DEFAULT_MINIMUM_SIZE, ENCODERS, MAX_LEVELS
+
+ROUTES = [
+    "/movies/44",
+    "/movies/?limit=250",
+    "/characters/2",
+    "/characters/?limit=250&sort=number_of_lines",
+    "/lines/49",
+    "/lines/?limit=250",
+    "/conversations/25",
+    "/conversations/25?stream=true",
+    "/analytics/?group_by=year&group_by=gender",
+    "/autocomplete/?q=the",
+]
+
+
+def fetch(target, path, timeout):
+    request = urllib.request.Request(
+        target.rstrip("/") + path, headers={"Accept-Encoding": "identity"}
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.read()
+
+
+def compress(encoding, level, body):
+    encoder = ENCODERS[encoding](level)
+    return encoder.compress(body) + encoder.finish()
+
+
+def measure(encoding, level, body, runs):
+    start = time.process_time()
+    for _ in range(runs):
+        compressed = compress(encoding, level, body)
+    return len(compressed), (time.process_time() - start) / runs * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure response compression per route.")
+    parser.add_argument("--target", required=True, help="base url of the deployment")
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--level", type=int, help="level for every encoding, capped as in the middleware")
+    args = parser.parse_args()
+
+    bodies = [(path, fetch(args.target, path, args.timeout)) for path in ROUTES]
+
+    print(f"encodings: {', '.join(ENCODERS)}, minimum size {DEFAULT_MINIMUM_SIZE} bytes\n")
+    print(f"{'route':<46}{'encoding':>10}{'level':>7}{'bytes':>10}{'sent':>10}{'saved':>8}{'cpu (us)':>11}")
+    totals = {encoding: [0, 0, 0.0] for encoding in ENCODERS}
+    for path, body in bodies:
+        for encoding in ENCODERS:
+            level = min(args.level, MAX_LEVELS[encoding]) if args.level else DEFAULT_LEVELS[encoding]
+            if len(body) < DEFAULT_MINIMUM_SIZE:
+                sent, cpu = len(body), 0.0
+            else:
+                sent, cpu = measure(encoding, level, body, args.runs)
+            totals[encoding][0] += len(body)
+            totals[encoding][1] += sent
+            totals[encoding][2] += cpu
+            print(
+                f"{path:<46}{encoding:>10}{level:>7}{len(body):>10}{sent:>10}"
+                f"{1 - sent / len(body) if body else 0:>8.1%}{cpu:>11.1f}"
+            )
+
+    print()
+    for encoding, (size, sent, cpu) in totals.items():
+        print(
+            f"{encoding}: {size} -> {sent} bytes, {1 - sent / size if size else 0:.1%} saved, "
+            f"{cpu:.0f}us of CPU for one request to every route"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Before/after report of the index migrations for every endpoint query.
+
+For each endpoint the router's own statement is run under EXPLAIN ANALYZE
+with the migrations downgraded to `--before` and again upgraded to
+`--after`, and the median execution time and the scans in the plan are
+reported as a markdown table to paste into the review.
+
+This changes the schema of the database it runs against, so it refuses to
+run without `--yes`.
+
+    python -m benchmarks.bench_indexes --yes [--before 0] [--after HEAD]
+"""
+import argparse
+import json
+import statistics
+
+from src import database as db
+from src import migrations
+from src.api import characters, conversations, lines, movies
+
+RUNS = 5
+
+ENDPOINTS = [
+    ("GET /movies/{id}", movies.top_characters_stmt, {"movie_id": 44}),
+    (
+        "GET /movies/?sort=movie_title",
+        movies.list_movies_stmt(movies.movie_sort_options.movie_title, False),
+        {"limit": 50, "offset": 0},
+    ),
+    (
+        "GET /movies/?sort=year",
+        movies.list_movies_stmt(movies.movie_sort_options.year, False),
+        {"limit": 50, "offset": 0},
+    ),
+    (
+        "GET /movies/?name=big&sort=rating",
+        movies.list_movies_stmt(movies.movie_sort_options.rating, True),
+        {"limit": 50, "offset": 0, "name": "%big%"},
+    ),
+    ("GET /characters/{id}", characters.top_conversations_stmt, {"character_id": 2}),
+    (
+        "GET /characters/?sort=character",
+        characters.list_characters_stmt(characters.character_sort_options.character, False),
+        {"limit": 50, "offset": 0},
+    ),
+    (
+        "GET /characters/?name=amy&sort=number_of_lines",
+        characters.list_characters_stmt(characters.character_sort_options.number_of_lines, True),
+        {"limit": 50, "offset": 0, "name": "%amy%"},
+    ),
+    (
+        "GET /characters/?fields=character_id,character",
+        characters.list_characters_stmt(
+            characters.character_sort_options.character, False, frozenset(["character_id", "character"])
+        ),
+        {"limit": 50, "offset": 0},
+    ),
+    ("GET /lines/{id}", lines.line_stmt(frozenset(lines.LINE_FIELDS)), {"line_id": 49}),
+    (
+        "GET /lines/?character=..&movie=..",
+        lines.list_lines_stmt(True, True),
+        {"limit": 50, "offset": 0, "character": "%dr. manhattan%", "movie": "%watchmen%"},
+    ),
+    (
+        "GET /conversations/{id}",
+        conversations.conversation_lines_stmt(False),
+        {"conversation_id": 25, "after": 0},
+    ),
+]
+
+
+def scans(plan):
+    """Lists the table scans of a plan, e.g. `Index Scan using x on lines`."""
+    found = []
+    if "Relation Name" in plan:
+        scan = plan["Node Type"]
+        if "Index Name" in plan:
+            scan += f" using {plan['Index Name']}"
+        found.append(f"{scan} on {plan['Relation Name']}")
+    for child in plan.get("Plans", []):
+        found += scans(child)
+    return found
+
+
+def explain(conn, stmt, params):
+    compiled = stmt.compile(dialect=db.engine.dialect)
+    result = conn.exec_driver_sql(
+        "EXPLAIN (ANALYZE, FORMAT JSON) " + str(compiled), compiled.construct_params(params)
+    ).scalar()
+    if isinstance(result, str):
+        result = json.loads(result)
+    return result[0]["Execution Time"], "<br>".join(scans(result[0]["Plan"]))
+
+
+def measure():
+    results = {}
+    with db.engine.connect() as conn:
+        conn.exec_driver_sql("ANALYZE")
+        for name, stmt, params in ENDPOINTS:
+            runs = [explain(conn, stmt, params) for _ in range(RUNS)]
+            results[name] = (statistics.median(t for t, _ in runs), runs[-1][1])
+        conn.rollback()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the index migrations per endpoint.")
+    parser.add_argument("--before", type=int, default=0)
+    parser.add_argument("--after", type=int, default=migrations.HEAD)
+    parser.add_argument("--yes", action="store_true", help="allow changing the database schema")
+    args = parser.parse_args()
+    if not args.yes:
+        parser.error("this migrates the database up and down, pass --yes to run it")
+
+    with db.engine.begin() as conn:
+        original_version = migrations.current_version(conn)
+
+    migrations.downgrade(args.before)
+    before = measure()
+    migrations.upgrade(args.after)
+    after = measure()
+
+    if original_version < args.after:
+        migrations.downgrade(original_version)
+    else:
+        migrations.upgrade(original_version)
+
+    print(f"\n| endpoint | v{args.before} ms | v{args.after} ms | speedup | v{args.before} scans | v{args.after} scans |")
+    print("|---|---:|---:|---:|---|---|")
+    for name, _, _ in ENDPOINTS:
+        before_ms, before_plan = before[name]
+        after_ms, after_plan = after[name]
+        print(
+            f"| {name} | {before_ms:.2f} | {after_ms:.2f} | {before_ms / after_ms:.1f}x "
+            f"| {before_plan} | {after_plan} |"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Measures the Python-side cost of preparing the router statements, without
+touching the database.
+
+* `rebuilt` is how the routers used to work: build the select() construct
+  with the request's literal values and generate its cache key, which is
+  what SQLAlchemy's compiled cache hashes before reusing a compiled form.
+* `compiled` is the same but compiling from scratch, i.e. a compiled cache
+  miss.
+* `cached` is the current approach: look up the statement built once with
+  bound parameters. Its cache key is memoized on the statement.
+
+Run from the repository root with `python -m benchmarks.bench_statements`.
+"""
+import timeit
+
+import sqlalchemy
+
+from src import database as db
+from src.api import characters, lines, movies
+
+ITERATIONS = 2000
+
+
+def rebuilt_get_character(id):
+    conversations_shared = (
+        sqlalchemy.select(
+            db.conversations.c.conversation_id,
+            db.conversations.c.character1_id.label("character_id"),
+        )
+        .where(db.conversations.c.character2_id == id)
+        .group_by(db.conversations.c.conversation_id)
+        .union(
+            sqlalchemy.select(
+                db.conversations.c.conversation_id,
+                db.conversations.c.character2_id.label("character_id"),
+            )
+            .where(db.conversations.c.character1_id == id)
+            .group_by(db.conversations.c.conversation_id)
+        )
+        .alias()
+    )
+    lines_shared = (
+        sqlalchemy.select(conversations_shared.c.character_id, db.lines.c.line_id)
+        .select_from(db.lines.join(conversations_shared))
+        .group_by(db.lines.c.line_id, conversations_shared.c.character_id)
+        .alias()
+    )
+    return (
+        sqlalchemy.select(
+            db.characters.c.character_id,
+            db.characters.c.name,
+            db.characters.c.gender,
+            sqlalchemy.func.count(lines_shared.c.character_id).label("number_of_lines_together"),
+        )
+        .select_from(db.characters.join(lines_shared))
+        .order_by(sqlalchemy.desc("number_of_lines_together"))
+        .group_by(db.characters.c.character_id)
+    )
+
+
+def rebuilt_list_characters(name, limit, offset):
+    return (
+        sqlalchemy.select(
+            db.characters.c.character_id,
+            db.characters.c.name,
+            sqlalchemy.func.count(db.lines.c.character_id).label("number_of_lines"),
+            db.movies.c.title,
+        )
+        .select_from(db.characters.join(db.lines).join(db.movies))
+        .limit(limit)
+        .offset(offset)
+        .order_by(db.characters.c.name, db.characters.c.character_id)
+        .group_by(db.characters.c.character_id, db.movies.c.title)
+        .where(db.characters.c.name.ilike(f"%{name}%"))
+    )
+
+
+def rebuilt_list_movies(name, limit, offset):
+    return (
+        sqlalchemy.select(
+            db.movies.c.movie_id,
+            db.movies.c.title,
+            db.movies.c.year,
+            db.movies.c.imdb_rating,
+            db.movies.c.imdb_votes,
+        )
+        .limit(limit)
+        .offset(offset)
+        .order_by(sqlalchemy.desc(db.movies.c.imdb_rating), db.movies.c.movie_id)
+        .where(db.movies.c.title.ilike(f"%{name}%"))
+    )
+
+
+def rebuilt_get_lines(character, movie, limit, offset):
+    return (
+        sqlalchemy.select(
+            db.lines.c.line_id,
+            db.movies.c.title,
+            db.lines.c.line_text,
+            db.characters.c.name,
+        )
+        .select_from(db.lines.join(db.characters).join(db.movies))
+        .limit(limit)
+        .offset(offset)
+        .order_by(db.lines.c.line_id, db.lines.c.line_sort)
+        .group_by(
+            db.lines.c.line_id,
+            db.movies.c.title,
+            db.characters.c.name,
+            db.lines.c.line_text,
+        )
+        .where(db.characters.c.name.ilike(f"%{character}%"))
+        .where(db.movies.c.title.ilike(f"%{movie}%"))
+    )
+
+
+CASES = [
+    (
+        "get_character",
+        lambda: rebuilt_get_character(2),
+        lambda: characters.top_conversations_stmt,
+    ),
+    (
+        "list_characters",
+        lambda: rebuilt_list_characters("amy", 50, 0),
+        lambda: characters.list_characters_stmt(characters.character_sort_options.character, True),
+    ),
+    (
+        "list_movies",
+        lambda: rebuilt_list_movies("big", 50, 0),
+        lambda: movies.list_movies_stmt(movies.movie_sort_options.rating, True),
+    ),
+    (
+        "get_lines",
+        lambda: rebuilt_get_lines("dr. manhattan", "watchmen", 50, 0),
+        lambda: lines.list_lines_stmt(True, True),
+    ),
+]
+
+
+def main():
+    dialect = db.engine.dialect
+
+    print(f"{'route':<18}{'rebuilt (us)':>14}{'compiled (us)':>15}{'cached (us)':>14}{'speedup':>10}")
+    for name, rebuild, cached in CASES:
+        rebuilt_time = timeit.timeit(lambda: rebuild()._generate_cache_key(), number=ITERATIONS)
+        compiled_time = timeit.timeit(lambda: rebuild().compile(dialect=dialect), number=ITERATIONS)
+        cached_time = timeit.timeit(lambda: cached()._generate_cache_key(), number=ITERATIONS)
+        rebuilt_us = rebuilt_time / ITERATIONS * 1e6
+        compiled_us = compiled_time / ITERATIONS * 1e6
+        cached_us = cached_time / ITERATIONS * 1e6
+        print(
+            f"{name:<18}{rebuilt_us:>14.1f}{compiled_us:>15.1f}{cached_us:>14.1f}"
+            f"{rebuilt_us / cached_us:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
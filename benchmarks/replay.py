@@ -0,0 +1,170 @@
+"""
+Replays traffic recorded by src/capture.py against a deployment and compares
+the latencies with the recorded ones.
+
+    python -m benchmarks.replay captured.jsonl --target http://localhost:3000
+    python -m benchmarks.replay captured.jsonl --target ... --speed 4
+    python -m benchmarks.replay captured.jsonl --target ... --speed 0
+    python -m benchmarks.replay captured.jsonl --target ... --warm 100
+
+`--speed` scales the original inter-arrival times, 1 replays at the recorded
+pace, 4 four times faster and 0 as fast as `--concurrency` allows. `--warm`
+only sends the N most frequently recorded requests once each, which is a
+cheap way to warm caches with the recorded hot keys.
+
+The report groups requests by route, with numeric path segments replaced by
+{id}, and lists recorded and replayed latency percentiles side by side.
+"""
+import argparse
+import http.client
+import json
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+ID_RE = re.compile(r"/\d+(?=/|$)")
+
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    records.sort(key=lambda r: r["ts"])
+    return records
+
+
+def route(record):
+    return f"{record['method']} {ID_RE.sub('/{id}', record['path'])}"
+
+
+def request_key(record):
+    return (record["method"], record["path"], record["query"], record["body"])
+
+
+def send(target, record, timeout):
+    url = target.rstrip("/") + record["path"]
+    if record["query"]:
+        url += "?" + record["query"]
+    data = None
+    headers = {}
+    if record["body"]:
+        data = record["body"].encode("utf-8")
+        headers["Content-Type"] = "application/json"
+
+    request = urllib.request.Request(url, data=data, headers=headers, method=record["method"])
+    start = time.perf_counter()
+    try:
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+            e.read()
+    except (OSError, http.client.HTTPException):
+        # refused, dropped or timed out, which is what an overloaded target
+        # does, recorded as a request without a status
+        status = None
+    return status, (time.perf_counter() - start) * 1000
+
+
+def replay(records, target, speed, concurrency, timeout):
+    results = [None] * len(records)
+    lock = threading.Lock()
+
+    def run(i, record):
+        result = send(target, record, timeout)
+        with lock:
+            results[i] = result
+
+    start = time.perf_counter()
+    first_ts = records[0]["ts"] if records else 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for i, record in enumerate(records):
+            if speed > 0:
+                delay = (record["ts"] - first_ts) / speed - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            pool.submit(run, i, record)
+    return results, time.perf_counter() - start
+
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def report(records, results, elapsed):
+    by_route = defaultdict(lambda: {"recorded": [], "replayed": [], "mismatched": 0})
+    missing = 0
+    for record, result in zip(records, results):
+        stats = by_route[route(record)]
+        if record["latency_ms"] is not None:
+            stats["recorded"].append(record["latency_ms"])
+        if result is None:
+            # the request failed in a way send() does not handle
+            missing += 1
+            stats["mismatched"] += 1
+            continue
+        status, latency = result
+        stats["replayed"].append(latency)
+        if status != record["status"]:
+            stats["mismatched"] += 1
+
+    print(f"replayed {len(records)} requests in {elapsed:.1f}s")
+    if missing:
+        print(f"{missing} requests have no result")
+    print()
+    print(
+        f"{'route':<42}{'count':>7}{'rec p50':>10}{'rep p50':>10}"
+        f"{'rec p95':>10}{'rep p95':>10}{'p95 diff':>10}{'status !=':>11}"
+    )
+    for name, stats in sorted(by_route.items(), key=lambda item: -len(item[1]["replayed"])):
+        recorded_p95 = percentile(stats["recorded"], 95)
+        replayed_p95 = percentile(stats["replayed"], 95)
+        print(
+            f"{name:<42}{len(stats['replayed']):>7}"
+            f"{percentile(stats['recorded'], 50):>10.1f}{percentile(stats['replayed'], 50):>10.1f}"
+            f"{recorded_p95:>10.1f}{replayed_p95:>10.1f}{replayed_p95 - recorded_p95:>+10.1f}"
+            f"{stats['mismatched']:>11}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured Movie API traffic.")
+    parser.add_argument("log", help="JSONL file written by the capture middleware")
+    parser.add_argument("--target", required=True, help="base url of the deployment")
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--warm", type=int, metavar="N", help="only send the N hottest requests once")
+    parser.add_argument(
+        "--include-writes",
+        action="store_true",
+        help="also replay non-GET requests, which modify the target's data",
+    )
+    args = parser.parse_args()
+
+    records = load(args.log)
+    if not args.include_writes:
+        records = [r for r in records if r["method"] == "GET"]
+
+    if args.warm is not None:
+        hot = Counter(request_key(r) for r in records).most_common(args.warm)
+        first = {}
+        for record in records:
+            first.setdefault(request_key(record), record)
+        records = [first[key] for key, _ in hot]
+        args.speed = 0
+
+    results, elapsed = replay(records, args.target, args.speed, args.concurrency, args.timeout)
+    report(records, results, elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Production entry point. main.py is for development.
+
+    python serve.py --workers 4
+
+Before starting the workers the read-only corpus is written to a snapshot
+file (see src/snapshot.py) which every worker memory-maps, so the memory used
+for it is shared instead of growing with the number of workers.
+
+Writes made through the API rebuild the snapshot in the background, the
+workers switch to the new file within a couple of seconds. After changing
+the database by other means, rebuild it from another shell:
+
+    python serve.py --rebuild-snapshot
+
+The snapshot only serves get_movie. The other in-memory read models are
+built by every worker for itself. A worker applies its own writes to them
+and drops them whenever the snapshot is rebuilt, so it also sees the writes
+of the other workers, see src/snapshot.py.
+"""
+import argparse
+import os
+
+import uvicorn
+
+DEFAULT_SNAPSHOT = "corpus.snapshot"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Movie API with multiple workers.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=3000)
+    parser.add_argument("--snapshot", default=DEFAULT_SNAPSHOT)
+    parser.add_argument(
+        "--rebuild-snapshot",
+        action="store_true",
+        help="rebuild and swap the snapshot file, then exit",
+    )
+    args = parser.parse_args()
+
+    # Imported here so the database is only touched once arguments are valid.
+    from src import snapshot
+
+    snapshot_path = os.path.abspath(args.snapshot)
+    snapshot.write_snapshot(snapshot_path)
+    if args.rebuild_snapshot:
+        return
+
+    # Workers are started after the snapshot exists and inherit its path.
+    os.environ[snapshot.SNAPSHOT_ENV] = snapshot_path
+    uvicorn.run(
+        "src.api.server:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        log_level="info",
+        env_file=".env",
+    )
+
+
+if __name__ == "__main__":
+    main()
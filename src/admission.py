@@ -0,0 +1,163 @@
+import asyncio
+import collections
+import os
+import re
+import time
+
+from starlette.responses import JSONResponse
+
+
+class Overloaded(Exception):
+    pass
+
+
+class PriorityClass:
+    """
+    A pool of request slots shared by every route assigned to the class.
+
+    At most `concurrency` requests of the class run at once, at most
+    `queue_depth` more wait for a slot and none waits longer than
+    `queue_timeout` seconds. Anything beyond that is shed immediately, so an
+    expensive class can never take more than its share of the threadpool.
+
+    The pool lives on the event loop thread, so it needs no locking.
+    """
+
+    def __init__(self, name, concurrency, queue_depth, queue_timeout, retry_after):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_depth = queue_depth
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.active = 0
+        self._waiters = collections.deque()
+        self._admitted = 0
+        self._shed = 0
+        self._queue_wait_total = 0.0
+        self._queue_wait_max = 0.0
+
+    @classmethod
+    def from_env(cls, name, concurrency, queue_depth, queue_timeout=1.0, retry_after=1):
+        """Build a class whose defaults can be overridden by ADMISSION_<NAME>_* variables."""
+        prefix = f"ADMISSION_{name.upper()}_"
+        return cls(
+            name,
+            int(os.environ.get(prefix + "CONCURRENCY", concurrency)),
+            int(os.environ.get(prefix + "QUEUE_DEPTH", queue_depth)),
+            float(os.environ.get(prefix + "QUEUE_TIMEOUT", queue_timeout)),
+            int(os.environ.get(prefix + "RETRY_AFTER", retry_after)),
+        )
+
+    async def acquire(self):
+        if self.active < self.concurrency and not self._waiters:
+            self.active += 1
+            self._admitted += 1
+            return
+
+        if len(self._waiters) >= self.queue_depth:
+            self._shed += 1
+            raise Overloaded()
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not waiter.done() or waiter.cancelled():
+                # release() hands slots over by resolving the future, so a
+                # cancelled waiter never got one.
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                self._shed += 1
+                raise Overloaded()
+        except asyncio.CancelledError:
+            # The client went away while queued. Leave the queue right away
+            # so it stops counting against queue_depth, and pass on a slot
+            # release() may have handed over in the meantime.
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            waited = time.monotonic() - start
+            self._queue_wait_total += waited
+            self._queue_wait_max = max(self._queue_wait_max, waited)
+        self._admitted += 1
+
+    def release(self):
+        # Hand the slot straight to the oldest waiter still waiting.
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self):
+        return {
+            "concurrency": self.concurrency,
+            "queue_depth": self.queue_depth,
+            "active": self.active,
+            "queued": len(self._waiters),
+            "admitted": self._admitted,
+            "shed": self._shed,
+            "queue_wait_ms_total": round(self._queue_wait_total * 1000, 3),
+            "queue_wait_ms_max": round(self._queue_wait_max * 1000, 3),
+        }
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware assigning each request to a priority class by method and
+    path and rejecting it with 503 + Retry-After when the class is full.
+
+    `rules` is a list of (method, path regex, class name) tuples, the first
+    matching rule wins and unmatched requests go to `default`.
+
+    With a `flight` (see src/singleflight.py), a GET identical to one whose
+    query is already running skips admission and waits for that query's
+    result, it needs neither a slot nor a connection of its own.
+    """
+
+    def __init__(self, app, classes, rules, default, flight=None):
+        self.app = app
+        self.classes = {c.name: c for c in classes}
+        self.rules = [(method, re.compile(pattern), name) for method, pattern, name in rules]
+        self.default = default
+        self.flight = flight
+
+    def classify(self, method, path):
+        for rule_method, pattern, name in self.rules:
+            if rule_method == method and pattern.fullmatch(path):
+                return self.classes[name]
+        return self.classes[self.default]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if self.flight is not None and scope["method"] == "GET":
+            target = (scope["method"], scope["path"], scope["query_string"])
+            if self.flight.join(target):
+                await self.app(scope, receive, send)
+                return
+
+        priority_class = self.classify(scope["method"], scope["path"])
+        try:
+            await priority_class.acquire()
+        except Overloaded:
+            response = JSONResponse(
+                {"detail": f"server overloaded ({priority_class.name}), retry later"},
+                status_code=503,
+                headers={"Retry-After": str(priority_class.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            priority_class.release()
@@ -0,0 +1,66 @@
+from enum import Enum
+from typing import List, Optional
+
+from fastapi import APIRouter
+from fastapi.params import Query
+
+from src.cube import cube
+
+router = APIRouter()
+
+
+class dimension_options(str, Enum):
+    year = "year"
+    rating = "rating"
+    gender = "gender"
+    age = "age"
+
+
+@router.get("/analytics/", tags=["analytics"])
+def get_analytics(
+        group_by: List[dimension_options] = Query([]),
+        year: Optional[str] = None,
+        rating: Optional[int] = None,
+        gender: Optional[str] = None,
+        age: Optional[str] = None,
+):
+    """
+    This endpoint returns dialogue volume aggregated over movie and character
+    dimensions. It is served from a pre-aggregated cube, so it never scans the
+    `lines` table. For each group it returns:
+    * `number_of_lines`: The number of lines spoken in the group.
+    * `number_of_characters`: The number of characters with at least one line
+      in the group.
+    * one key per dimension in `group_by` holding the group's value.
+
+    The available dimensions are:
+    * `year` - The year the movie was released.
+    * `rating` - The imdb rating of the movie rounded down, e.g. 6.9 is `6`.
+    * `gender` - The gender of the character.
+    * `age` - The age of the character.
+
+    Pass `group_by` once per dimension to group by, e.g.
+    `/analytics/?group_by=year&group_by=gender`. Without `group_by` a single
+    total is returned.
+
+    Each dimension can also be used as a query parameter to keep only the
+    lines matching that value, e.g. `/analytics/?group_by=gender&rating=8`.
+
+    Groups are sorted by number of lines, highest to lowest.
+    """
+    dimensions = []
+    for dimension in group_by:
+        if dimension.value not in dimensions:
+            dimensions.append(dimension.value)
+
+    filters = {}
+    for dimension, value in (
+        ("year", year),
+        ("rating", rating),
+        ("gender", gender),
+        ("age", age),
+    ):
+        if value is not None:
+            filters[dimension] = value
+
+    return cube.query(dimensions, filters)
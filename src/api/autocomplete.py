@@ -0,0 +1,43 @@
+from enum import Enum
+from typing import Optional
+
+from fastapi import APIRouter
+from fastapi.params import Query
+
+from src.autocomplete import prefix_index
+
+router = APIRouter()
+
+
+class autocomplete_kind_options(str, Enum):
+    movie = "movie"
+    character = "character"
+
+
+@router.get("/autocomplete/", tags=["autocomplete"])
+@router.get("/autocomplete", tags=["autocomplete"], include_in_schema=False)
+def autocomplete(
+        q: str,
+        limit: int = Query(10, ge=1, le=50),
+        kind: Optional[autocomplete_kind_options] = None,
+):
+    """
+    This endpoint returns movies and characters whose title or name, or any
+    word in it, starts with `q`, most popular first. Movies and characters
+    are ranked against each other by `rank` rather than `popularity`. It is served from memory
+    and meant to be called on every keystroke. For each result it returns:
+    * `kind`: `movie` or `character`.
+    * `id`: the internal id of the movie or character. Can be used to query
+      the `/movies/{movie_id}` or `/characters/{character_id}` endpoint.
+    * `label`: The title of the movie or the name of the character.
+    * `movie`: The movie the character is from, for characters only.
+    * `popularity`: The number of IMDB votes for movies and the number of
+      lines for characters.
+    * `rank`: The fraction of movies, or of characters, that are at most as
+      popular, between 0 and 1.
+
+    You can restrict the results to movies or characters with the `kind`
+    query parameter. The `limit` query parameter specifies the maximum number
+    of results to return.
+    """
+    return prefix_index.search(q, limit, kind.value if kind is not None else None)
@@ -1,15 +1,110 @@
+import functools
+
 import sqlalchemy
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Response
 from enum import Enum
 from fastapi.params import Query
 
 from src import database as db
+from src.api.fields import parse_fields
+from src.counts import set_total_headers, totals
+from src.similarity import TOP_K, IndexNotReady, similarity_index
+from src.singleflight import flight
 
 router = APIRouter()
 
+# Statements are built once at import time with bound parameters, so a
+# request only binds its values and SQLAlchemy's compiled cache is hit
+# instead of rebuilding and recompiling the construct every time.
+character_id_param = sqlalchemy.bindparam("character_id")
+
+@functools.lru_cache(maxsize=None)
+def character_stmt(with_movie):
+    """Returns the character lookup, joining movies only for `with_movie`."""
+    columns = [
+        db.characters.c.character_id,
+        db.characters.c.name,
+        db.characters.c.gender,
+    ]
+    select_from = db.characters
+    if with_movie:
+        columns.append(db.movies.c.title)
+        select_from = select_from.join(db.movies)
+
+    return (
+        sqlalchemy.select(*columns)
+        .select_from(select_from)
+        .where(
+            db.characters.c.character_id == character_id_param
+        )
+    )
+
+
+# gets conversation_id | character_id for all convos with id
+conversations_shared = (
+    sqlalchemy.select(
+        db.conversations.c.conversation_id,
+        db.conversations.c.character1_id.label("character_id")
+    )
+    .where(
+        db.conversations.c.character2_id == character_id_param
+    )
+    .group_by(
+        db.conversations.c.conversation_id
+    )
+    .union(
+        sqlalchemy.select(
+            db.conversations.c.conversation_id,
+            db.conversations.c.character2_id.label("character_id")
+        )
+        .where(
+            db.conversations.c.character1_id == character_id_param
+        )
+        .group_by(
+            db.conversations.c.conversation_id
+        )
+    ).alias()
+)
+
+lines_shared = (
+    sqlalchemy.select(
+        conversations_shared.c.character_id,
+        db.lines.c.line_id
+    )
+    .select_from(
+        db.lines.join(conversations_shared)
+    )
+    .group_by(
+        db.lines.c.line_id,
+        conversations_shared.c.character_id
+    ).alias()
+)
+
+top_conversations_stmt = (
+    sqlalchemy.select(
+        db.characters.c.character_id,
+        db.characters.c.name,
+        db.characters.c.gender,
+        sqlalchemy.func.count(lines_shared.c.character_id).label("number_of_lines_together")
+    )
+    .select_from(
+        db.characters.join(lines_shared)
+    )
+    .order_by(
+        sqlalchemy.desc("number_of_lines_together")
+    )
+    .group_by(
+        db.characters.c.character_id
+    )
+)
+
+
+CHARACTER_FIELDS = ("character_id", "character", "movie", "gender", "top_conversations")
+
 
 @router.get("/characters/{id}", tags=["characters"])
-def get_character(id: int):
+@flight.coalesce
+def get_character(id: int, fields: str = ""):
     """
     This endpoint returns a single character by its identifier. For each character
     it returns:
@@ -28,105 +123,77 @@ def get_character(id: int):
     * `gender`: The gender of the character.
     * `number_of_lines_together`: The number of lines the character has with the
       originally queried character.
+
+    You can pick which of the character's keys are returned with the `fields`
+    query parameter, a comma separated list such as `fields=character,movie`.
+    Keys that are not requested are not queried, leaving out
+    `top_conversations` skips its aggregate entirely.
     """
-    json = None
+    fields = parse_fields(fields, CHARACTER_FIELDS)
 
-    stmt1 = (
-        sqlalchemy.select(
-            db.characters.c.character_id,
-            db.characters.c.name,
-            db.movies.c.title,
-            db.characters.c.gender,
-        )
-        .select_from(
-            db.characters.join(db.movies)
-        )
-        .where(
-            db.characters.c.character_id == id
-        )
-    )
+    with db.connect("get_character") as conn:
+        params = {"character_id": id}
+        character_result = conn.execute(character_stmt("movie" in fields), params).fetchone()
+        if character_result is None:
+            raise HTTPException(status_code=404, detail="movie not found.")
 
-    # gets conversation_id | character_id for all convos with id
-    conversations_shared = (
-        sqlalchemy.select(
-            db.conversations.c.conversation_id,
-            db.conversations.c.character1_id.label("character_id")
-        )
-        .where(
-            db.conversations.c.character2_id == id
-        )
-        .group_by(
-            db.conversations.c.conversation_id
-        )
-        .union(
-            sqlalchemy.select(
-                db.conversations.c.conversation_id,
-                db.conversations.c.character2_id.label("character_id")
-            )
-            .where(
-                db.conversations.c.character1_id == id
-            )
-            .group_by(
-                db.conversations.c.conversation_id
-            )
-        ).alias()
-    )
+        json = {}
+        if "character_id" in fields:
+            json["character_id"] = character_result.character_id
+        if "character" in fields:
+            json["character"] = character_result.name
+        if "movie" in fields:
+            json["movie"] = character_result.title
+        if "gender" in fields:
+            json["gender"] = character_result.gender
 
-    lines_shared = (
-        sqlalchemy.select(
-            conversations_shared.c.character_id,
-            db.lines.c.line_id
-        )
-        .select_from(
-            db.lines.join(conversations_shared)
-        )
-        .group_by(
-            db.lines.c.line_id,
-            conversations_shared.c.character_id
-        ).alias()
-    )
+        if "top_conversations" in fields:
+            conversations_result = conn.execute(top_conversations_stmt, params)
+            top_conversations = []
+            for character in conversations_result:
+                top_conversations.append({
+                    "character_id": character.character_id,
+                    "character": character.name,
+                    "gender": character.gender,
+                    "number_of_lines_together": character.number_of_lines_together
+                })
+            json["top_conversations"] = top_conversations
 
-    stmt2 = (
-        sqlalchemy.select(
-            db.characters.c.character_id,
-            db.characters.c.name,
-            db.characters.c.gender,
-            sqlalchemy.func.count(lines_shared.c.character_id).label("number_of_lines_together")
-        )
-        .select_from(
-            db.characters.join(lines_shared)
-        )
-        .order_by(
-            sqlalchemy.desc("number_of_lines_together")
-        )
-        .group_by(
-            db.characters.c.character_id
-        )
-    )
+    return json
 
-    with db.engine.connect() as conn:
-        character_result = conn.execute(stmt1).fetchone()
-        if character_result is None:
-            raise HTTPException(status_code=404, detail="movie not found.")
 
-        conversations_result = conn.execute(stmt2)
-        top_conversations = []
-        for character in conversations_result:
-            top_conversations.append({
-                "character_id": character.character_id,
-                "character": character.name,
-                "gender": character.gender,
-                "number_of_lines_together": character.number_of_lines_together
-            })
-        json = {
-            "character_id": character_result.character_id,
-            "character": character_result.name,
-            "movie": character_result.title,
-            "gender": character_result.gender,
-            "top_conversations": top_conversations
-        }
+@router.get("/characters/{id}/similar", tags=["characters"])
+def get_similar_characters(
+        id: int,
+        limit: int = Query(TOP_K, ge=1, le=TOP_K),
+):
+    """
+    This endpoint returns the characters whose dialogue is most similar to
+    the character's, most similar first. Similarity is the cosine similarity
+    of the TF-IDF vectors of everything each character says, precomputed in
+    memory, so the database is not queried. For each character it returns:
+    * `character_id`: the internal id of the character.
+    * `character`: The name of the character.
+    * `movie`: The movie the character is from.
+    * `similarity`: The similarity between 0 and 1.
+
+    The `limit` query parameter specifies the maximum number of characters to
+    return.
 
-    return json
+    The index is built in the background when the server starts. Until it is
+    ready the endpoint returns 503 with a `Retry-After` header.
+    """
+    try:
+        similar = similarity_index.similar(id, limit)
+    except IndexNotReady:
+        raise HTTPException(
+            status_code=503,
+            detail="similarity index is being built.",
+            headers={"Retry-After": "5"},
+        )
+    if similar is None:
+        raise HTTPException(status_code=404, detail="character not found.")
+    return similar
 
 
 class character_sort_options(str, Enum):
@@ -135,12 +202,78 @@ class character_sort_options(str, Enum):
     number_of_lines = "number_of_lines"
 
 
+LIST_CHARACTER_FIELDS = ("character_id", "character", "movie", "number_of_lines")
+
+
+@functools.lru_cache(maxsize=None)
+def list_characters_stmt(sort, filtered, fields=frozenset(LIST_CHARACTER_FIELDS)):
+    """
+    Returns the list statement for a sort option selecting `fields`, filtered
+    by the `name` bound parameter when `filtered` is set. There are only a
+    handful of variants, so each is built once and cached.
+
+    Movies are only joined when their title is selected or sorted on, and
+    lines are only counted when `number_of_lines` is. Otherwise an EXISTS
+    keeps the same rows as the join would: characters of an existing movie
+    with at least one line.
+    """
+    with_movie = "movie" in fields or sort is character_sort_options.movie
+    with_lines = "number_of_lines" in fields or sort is character_sort_options.number_of_lines
+
+    if sort is character_sort_options.character:
+        order_by = db.characters.c.name
+    elif sort is character_sort_options.movie:
+        order_by = db.movies.c.title
+    elif sort is character_sort_options.number_of_lines:
+        order_by = sqlalchemy.desc("number_of_lines")
+    else:
+        assert False
+
+    columns = [db.characters.c.character_id, db.characters.c.name]
+    select_from = db.characters
+    group_by = [db.characters.c.character_id]
+    if with_lines:
+        columns.append(sqlalchemy.func.count(db.lines.c.character_id).label("number_of_lines"))
+        select_from = select_from.join(db.lines)
+    if with_movie:
+        columns.append(db.movies.c.title)
+        select_from = select_from.join(db.movies)
+        group_by.append(db.movies.c.title)
+
+    stmt = (
+        sqlalchemy.select(*columns)
+        .select_from(select_from)
+        .limit(sqlalchemy.bindparam("limit"))
+        .offset(sqlalchemy.bindparam("offset"))
+        .order_by(order_by, db.characters.c.character_id)
+    )
+    if with_lines:
+        stmt = stmt.group_by(*group_by)
+    else:
+        stmt = stmt.where(
+            sqlalchemy.exists().where(db.lines.c.character_id == db.characters.c.character_id)
+        )
+    if not with_movie:
+        stmt = stmt.where(
+            sqlalchemy.exists().where(db.movies.c.movie_id == db.characters.c.movie_id)
+        )
+
+    # filter only if name parameter is passed
+    if filtered:
+        stmt = stmt.where(db.characters.c.name.ilike(sqlalchemy.bindparam("name")))
+
+    return stmt
+
+
 @router.get("/characters/", tags=["characters"])
 def list_characters(
+        response: Response,
         name: str = "",
         limit: int = Query(50, ge=1, le=250),
         offset: int = Query(0, ge=0),
         sort: character_sort_options = character_sort_options.character,
+        count: bool = False,
+        fields: str = "",
 ):
     """
     This endpoint returns a list of characters. For each character it returns:
@@ -158,52 +291,45 @@ def list_characters(
     * `movie` - Sort by movie title alphabetically.
     * `number_of_lines` - Sort by number of lines, highest to lowest.
 
+    You can pick which keys are returned with the `fields` query parameter, a
+    comma separated list such as `fields=character,movie`. Keys that are not
+    requested are not queried, so leaving out `number_of_lines` skips
+    counting lines unless sorting by it.
+
     The `limit` and `offset` query
     parameters are used for pagination. The `limit` query parameter specifies the
     maximum number of results to return. The `offset` query parameter specifies the
     number of results to skip before returning results.
-    """
-    if sort is character_sort_options.character:
-        order_by = db.characters.c.name
-    elif sort is character_sort_options.movie:
-        order_by = db.movies.c.title
-    elif sort is character_sort_options.number_of_lines:
-        order_by = sqlalchemy.desc("number_of_lines")
-    else:
-        assert False
 
-    stmt = (
-        sqlalchemy.select(
-            db.characters.c.character_id,
-            db.characters.c.name,
-            sqlalchemy.func.count(db.lines.c.character_id).label("number_of_lines"),
-            db.movies.c.title,
-        )
-        .select_from(db.characters.join(db.lines).join(db.movies))
-        .limit(limit)
-        .offset(offset)
-        .order_by(order_by, db.characters.c.character_id)
-        .group_by(
-            db.characters.c.character_id,
-            db.movies.c.title
-        )
-    )
-
-    # filter only if name parameter is passed
+    Passing `count=true` adds the total number of results to the
+    `X-Total-Count` response header. `X-Total-Count-Exact` is `false` when the
+    total is the database's estimate, which can be the case for filtered lists.
+    """
+    fields = parse_fields(fields, LIST_CHARACTER_FIELDS)
+    params = {"limit": limit, "offset": offset}
     if name != "":
-        stmt = stmt.where(db.characters.c.name.ilike(f"%{name}%"))
+        params["name"] = f"%{name}%"
 
-    with db.engine.connect() as conn:
-        result = conn.execute(stmt)
+    stmt = list_characters_stmt(sort, name != "", fields)
+    with db.connect("list_characters") as conn:
+        result = conn.execute(stmt, params)
         json = []
         for row in result:
-            json.append(
-                {
-                    "character_id": row.character_id,
-                    "character": row.name,
-                    "movie": row.title,
-                    "number_of_lines": row.number_of_lines
-                }
+            character = {}
+            if "character_id" in fields:
+                character["character_id"] = row.character_id
+            if "character" in fields:
+                character["character"] = row.name
+            if "movie" in fields:
+                character["movie"] = row.title
+            if "number_of_lines" in fields:
+                character["number_of_lines"] = row.number_of_lines
+            json.append(character)
+
+        if count:
+            total, exact = totals.total(
+                conn, "characters", stmt, params, name != "", offset, len(json), limit
             )
+            set_total_headers(response, total, exact)
 
     return json
@@ -1,11 +1,23 @@
+import functools
+import json
+import logging
 import random
 
 import sqlalchemy
 from fastapi import APIRouter, HTTPException
+from fastapi.params import Query
+from fastapi.responses import StreamingResponse
 
 from src import database as db
+from src import snapshot
+from src.singleflight import flight
+from src.autocomplete import prefix_index
+from src.counts import totals
+from src.cube import cube
+from src.roster import roster
+from src.similarity import similarity_index
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 
 
 # FastAPI is inferring what the request body should look like
@@ -23,6 +35,19 @@ class ConversationJson(BaseModel):
 
 router = APIRouter()
 
+logger = logging.getLogger(__name__)
+
+# Number of lines fetched per round trip when streaming a transcript.
+STREAM_BATCH_SIZE = 500
+
+last_convo = sqlalchemy.select(
+    db.conversations.c.conversation_id
+).order_by(sqlalchemy.desc(db.conversations.c.conversation_id))
+
+last_line = sqlalchemy.select(
+    db.lines.c.line_id
+).order_by(sqlalchemy.desc(db.lines.c.line_id))
+
 
 @router.post("/movies/{movie_id}/conversations/", tags=["movies"])
 def add_conversation(movie_id: int, conversation: ConversationJson):
@@ -47,31 +72,10 @@ def add_conversation(movie_id: int, conversation: ConversationJson):
         if line.character_id != conversation.character_1_id and line.character_id != conversation.character_2_id:
             raise HTTPException(status_code=400, detail="lines don't match characters")
 
-    verify = (
-        sqlalchemy.select(
-            db.characters.c.movie_id,
-            db.characters.c.character_id
-        )
-        .select_from(db.characters)
-        .where(
-            db.characters.c.movie_id == movie_id and
-            (db.characters.c.character_id == conversation.character_1_id or
-             db.characters.c.character_id == conversation.character_2_id)
-        )
-    )
-
-    last_convo = sqlalchemy.select(
-        db.conversations.c.conversation_id
-    ).order_by(sqlalchemy.desc(db.conversations.c.conversation_id))
-
-    last_line = sqlalchemy.select(
-        db.lines.c.line_id
-    ).order_by(sqlalchemy.desc(db.lines.c.line_id))
-
     convo_id = 1
     next_line_id = 1
 
-    with db.engine.connect() as conn:
+    with db.connect("add_conversation") as conn:
         convo = conn.execute(last_convo).fetchone()
         line = conn.execute(last_line).fetchone()
         convo_id += convo.conversation_id
@@ -86,85 +90,188 @@ def add_conversation(movie_id: int, conversation: ConversationJson):
         movie_id=movie_id
     )
 
-    lines_statements = []
+    lines_rows = []
     line_sort = 1
     for line in conversation.lines:
-        lines_statements.append(db.lines.insert().values(
-            line_id=next_line_id,
-            character_id=line.character_id,
-            movie_id=movie_id,
-            conversation_id=convo_id,
-            line_sort=line_sort,
-            line_text=line.line_text
-        ))
+        lines_rows.append({
+            "line_id": next_line_id,
+            "character_id": line.character_id,
+            "movie_id": movie_id,
+            "conversation_id": convo_id,
+            "line_sort": line_sort,
+            "line_text": line.line_text
+        })
         line_sort += 1
         next_line_id += 1
 
-    with db.engine.connect() as conn:
-        result = conn.execute(verify).fetchall()
-        if len(result) < 2:
+    with db.connect("add_conversation") as conn:
+        character_ids = {conversation.character_1_id, conversation.character_2_id}
+        if roster.missing(conn, movie_id, character_ids):
             raise HTTPException(status_code=400, detail=f"1 or more characters not in movie")
         conn.execute(conversation_insert)
-        for line_statement in lines_statements:
-            conn.execute(line_statement)
+        # one executemany round trip for all of the lines
+        if lines_rows:
+            conn.execute(db.lines.insert(), lines_rows)
         conn.commit()
 
+    # The conversation is committed, so a failure keeping the in-memory read
+    # models up to date must not fail the request, a retry would insert it
+    # twice. The affected model is dropped and rebuilt instead.
+    line_character_ids = [line.character_id for line in conversation.lines]
+    post_commit_updates = [
+        (cube, lambda: cube.record_lines((row["line_id"], row["character_id"]) for row in lines_rows)),
+        (totals, lambda: totals.record_lines(line_character_ids)),
+        (prefix_index, lambda: prefix_index.record_lines(line_character_ids)),
+        (similarity_index, lambda: similarity_index.refresh(line_character_ids)),
+    ]
+    for read_model, update in post_commit_updates:
+        try:
+            update()
+        except Exception:
+            logger.exception("updating %s after add_conversation failed", type(read_model).__name__)
+            read_model.invalidate()
+    snapshot.request_rebuild()
+
     return convo_id
 
 
-@router.get("/conversations/{id}", tags=["lines"])
-def get_conversation(id: int):
-    """
-    This endpoint returns a full conversation. Each conversation includes
-    * 'conversation_id': id of the convo
-    * 'movie_id': id of the movie
-    * 'movie_title': title of the movie
-    * 'lines' all the lines in the conversation
+# Statements are built once at import time with bound parameters, see
+# src/api/characters.py.
+conversation_id_param = sqlalchemy.bindparam("conversation_id")
 
-    Lines follow this structure
-    * 'character_name': the name of the character speaking
-    * 'line': the full text of the line
-    """
-    stmt1 = (
-        sqlalchemy.select(
-            db.conversations.c.conversation_id,
-            db.conversations.c.movie_id,
-            db.movies.c.title,
-        )
-        .select_from(db.conversations.join(db.movies))
-        .where(
-            db.conversations.c.conversation_id == id
-        )
+conversation_stmt = (
+    sqlalchemy.select(
+        db.conversations.c.conversation_id,
+        db.conversations.c.movie_id,
+        db.movies.c.title,
+    )
+    .select_from(db.conversations.join(db.movies))
+    .where(
+        db.conversations.c.conversation_id == conversation_id_param
     )
+)
 
-    stmt2 = (
+@functools.lru_cache(maxsize=None)
+def conversation_lines_stmt(paged):
+    """
+    Returns the lines of a conversation in `line_sort` order starting after
+    the `after` bound parameter, limited to the `limit` bound parameter when
+    `paged` is set. Served by the (conversation_id, line_sort) index.
+    """
+    stmt = (
         sqlalchemy.select(
+            db.lines.c.line_sort,
             db.lines.c.line_text,
             db.characters.c.character_id,
             db.characters.c.name
         )
         .select_from(db.lines.join(db.characters))
         .where(
-            db.lines.c.conversation_id == id
+            db.lines.c.conversation_id == conversation_id_param,
+            db.lines.c.line_sort > sqlalchemy.bindparam("after")
         )
+        .order_by(db.lines.c.line_sort)
     )
 
-    with db.engine.connect() as conn:
-        result = conn.execute(stmt1).fetchone()
+    if paged:
+        stmt = stmt.limit(sqlalchemy.bindparam("limit"))
+
+    return stmt
+
+
+@router.get("/conversations/{id}", tags=["lines"])
+def get_conversation(
+        id: int,
+        after: int = Query(0, ge=0),
+        limit: Optional[int] = Query(None, ge=1, le=1000),
+        stream: bool = False,
+):
+    """
+    This endpoint returns a full conversation. Each conversation includes
+    * 'conversation_id': id of the convo
+    * 'movie_id': id of the movie
+    * 'movie_title': title of the movie
+    * 'lines' all the lines in the conversation, in the order they are spoken
+
+    Lines follow this structure
+    * 'character_name': the name of the character speaking
+    * 'line': the full text of the line
+
+    Long conversations can be paged through with the `limit` and `after`
+    query parameters. `limit` is the maximum number of lines to return and
+    `after` skips every line up to and including that position in the
+    conversation. When `limit` is passed the response also includes
+    * 'next_cursor': the `after` value for the next page, or null once the
+      last line has been returned.
+
+    Passing `stream=true` streams the conversation as newline delimited JSON
+    instead: one object with the conversation fields, then one object per
+    line with an additional 'line_sort' key holding its position.
+    """
+    if stream:
+        return stream_conversation(id, after)
+    return read_conversation(id, after, limit)
+
+
+@flight.coalesce
+def read_conversation(id, after, limit):
+    with db.connect("get_conversation") as conn:
+        # one extra line is fetched to know whether there is a next page
+        params = {"conversation_id": id, "after": after, "limit": (limit or 0) + 1}
+        result = conn.execute(conversation_stmt, params).fetchone()
         if result is None:
             raise HTTPException(status_code=404, detail="conversation not found.")
 
-        lines_result = conn.execute(stmt2)
+        lines_result = conn.execute(conversation_lines_stmt(limit is not None), params)
         all_lines = []
+        last_line_sort = None
+        has_more = False
         for line in lines_result:
+            if len(all_lines) == limit:
+                has_more = True
+                break
             all_lines.append({
                 "character_name": line.name,
                 "line": line.line_text
             })
+            last_line_sort = line.line_sort
+
+    transcript = {
+        "conversation_id": result.conversation_id,
+        "movie_id": result.movie_id,
+        "movie_title": result.title,
+        "lines": all_lines
+    }
+    if limit is not None:
+        transcript["next_cursor"] = last_line_sort if has_more else None
 
-        return {
+    return transcript
+
+
+def stream_conversation(id, after):
+    params = {"conversation_id": id, "after": after}
+    with db.connect("stream_conversation") as conn:
+        result = conn.execute(conversation_stmt, params).fetchone()
+        if result is None:
+            raise HTTPException(status_code=404, detail="conversation not found.")
+
+    def ndjson():
+        yield json.dumps({
             "conversation_id": result.conversation_id,
             "movie_id": result.movie_id,
             "movie_title": result.title,
-            "lines": all_lines
-        }
+        }) + "\n"
+        # Lines are fetched through a server side cursor in batches, so memory
+        # stays bounded no matter how long the conversation is.
+        with db.connect("stream_conversation") as conn:
+            lines_result = conn.execution_options(yield_per=STREAM_BATCH_SIZE).execute(
+                conversation_lines_stmt(False), params
+            )
+            for line in lines_result:
+                yield json.dumps({
+                    "line_sort": line.line_sort,
+                    "character_name": line.name,
+                    "line": line.line_text
+                }) + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
@@ -0,0 +1,225 @@
+import functools
+import os
+import secrets
+import sys
+import threading
+
+import anyio.to_thread
+import pkg_resources
+from enum import Enum
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from fastapi.params import Query
+from fastapi.responses import PlainTextResponse
+
+from src import database as db
+from src.profiling import format_stats, memory, profiler
+
+router = APIRouter()
+
+# Diagnostics are only served when DIAGNOSTICS_TOKEN is set, to requests
+# sending it as `Authorization: Bearer <token>`.
+
+
+def require_token(authorization: str = Header("")):
+    token = os.environ.get("DIAGNOSTICS_TOKEN")
+    if not token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    scheme, _, given = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not secrets.compare_digest(given.encode(), token.encode()):
+        raise HTTPException(
+            status_code=401,
+            detail="invalid diagnostics token.",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+def calc_container(path):
+    total_size = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for f in filenames:
+            fp = os.path.join(dirpath, f)
+            total_size += os.path.getsize(fp)
+    return total_size
+
+
+@functools.lru_cache(maxsize=None)
+def package_sizes():
+    """Sizes of the installed packages, walked once per process."""
+    message = []
+    for dist in pkg_resources.working_set:
+        try:
+            path = os.path.join(dist.location, dist.project_name)
+            size = calc_container(path)
+            if size / 1000 > 1.0:
+                message.append(
+                    {
+                        "dist": dist.project_name,
+                        "version": dist.version,
+                        "size_in_mb": size / (1000 * 1000),
+                    }
+                )
+        except OSError:
+            "{} no longer exists".format(dist.project_name)
+
+    return sorted(message, key=lambda d: d["size_in_mb"], reverse=True)
+
+
+@router.get("/diagnostics/pyversion/", dependencies=[Depends(require_token)])
+def version():
+    return sys.version_info
+
+
+@router.get("/diagnostics/pkgsize/", dependencies=[Depends(require_token)])
+def get_pkgsize():
+    return {"message": package_sizes()}
+
+
+class profile_mode_options(str, Enum):
+    sample = "sample"
+    cprofile = "cprofile"
+
+
+@router.post("/diagnostics/profiles/", status_code=201, dependencies=[Depends(require_token)])
+def start_profile(
+    request: Request,
+    route: str,
+    requests: int = Query(10, ge=1, le=1000),
+    mode: profile_mode_options = profile_mode_options.sample,
+    interval_ms: float = Query(5, ge=1, le=1000),
+):
+    """
+    Profiles the next `requests` calls of the route named `route`, e.g.
+    `get_character`. `sample` records the stack of the thread running each
+    call every `interval_ms` milliseconds, `cprofile` traces every function
+    call. The route goes back to normal once the requests are taken.
+    """
+    try:
+        session = profiler.arm(request.app.router.routes, route, requests, mode.value, interval_ms)
+    except KeyError:
+        names = sorted({r.name for r in request.app.router.routes if hasattr(r, "dependant")})
+        raise HTTPException(status_code=404, detail=f"route must be one of: {', '.join(names)}")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return session.report()
+
+
+@router.get("/diagnostics/profiles/", dependencies=[Depends(require_token)])
+def list_profiles():
+    return profiler.sessions()
+
+
+@router.get("/diagnostics/profiles/{id}", dependencies=[Depends(require_token)])
+def get_profile(id: int, top: int = Query(30, ge=1, le=500)):
+    """
+    Returns the state of a profiling session. For `cprofile` sessions `stats`
+    holds the functions with the highest cumulative time.
+    """
+    session = profiler.session(id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="profile not found.")
+    return session.report(top)
+
+
+@router.get(
+    "/diagnostics/profiles/{id}/folded",
+    response_class=PlainTextResponse,
+    dependencies=[Depends(require_token)],
+)
+def get_profile_folded(id: int):
+    """
+    Returns the sampled stacks as folded text, one `frame;frame;... count`
+    per line, which flamegraph.pl and speedscope read directly.
+    """
+    session = profiler.session(id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="profile not found.")
+    return session.folded()
+
+
+@router.delete("/diagnostics/profiles/{id}", dependencies=[Depends(require_token)])
+def cancel_profile(id: int):
+    session = profiler.cancel(id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="profile not found.")
+    return session.report()
+
+
+@router.post("/diagnostics/tracemalloc/start", dependencies=[Depends(require_token)])
+def start_tracemalloc(frames: int = Query(1, ge=1, le=100)):
+    """Starts tracing allocations, keeping `frames` frames per allocation."""
+    memory.start(frames)
+    return memory.state()
+
+
+@router.post("/diagnostics/tracemalloc/stop", dependencies=[Depends(require_token)])
+def stop_tracemalloc():
+    memory.stop()
+    return memory.state()
+
+
+@router.get("/diagnostics/tracemalloc/", dependencies=[Depends(require_token)])
+def get_tracemalloc():
+    return memory.state()
+
+
+class stats_group_options(str, Enum):
+    lineno = "lineno"
+    filename = "filename"
+    traceback = "traceback"
+
+
+@router.post("/diagnostics/tracemalloc/snapshots", dependencies=[Depends(require_token)])
+def take_snapshot(
+    top: int = Query(20, ge=1, le=500),
+    group_by: stats_group_options = stats_group_options.lineno,
+):
+    """Takes a snapshot of the traced allocations and returns its largest."""
+    try:
+        id, snapshot = memory.snapshot()
+    except RuntimeError:
+        raise HTTPException(status_code=409, detail="tracemalloc is not started.")
+    return {"id": id, "top": format_stats(snapshot.statistics(group_by.value), top)}
+
+
+@router.get("/diagnostics/tracemalloc/diff", dependencies=[Depends(require_token)])
+def diff_snapshots(
+    base: int,
+    current: int,
+    top: int = Query(20, ge=1, le=500),
+    group_by: stats_group_options = stats_group_options.lineno,
+):
+    """
+    Compares two snapshots, listing the locations whose allocated size grew
+    or shrank the most from `base` to `current`.
+    """
+    base_snapshot = memory.get(base)
+    current_snapshot = memory.get(current)
+    if base_snapshot is None or current_snapshot is None:
+        raise HTTPException(status_code=404, detail="snapshot not found.")
+    return format_stats(current_snapshot.compare_to(base_snapshot, group_by.value), top)
+
+
+@router.get("/diagnostics/runtime", dependencies=[Depends(require_token)])
+async def get_runtime():
+    """
+    Returns the state of the threadpool running the sync endpoints and of the
+    database connection pool.
+    """
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    limiter_stats = limiter.statistics()
+
+    pool = db.engine.pool
+    pool_state = {"status": pool.status()}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        if hasattr(pool, name):
+            pool_state[name] = getattr(pool, name)()
+
+    return {
+        "threadpool": {
+            "total_tokens": limiter_stats.total_tokens,
+            "borrowed_tokens": limiter_stats.borrowed_tokens,
+            "tasks_waiting": limiter_stats.tasks_waiting,
+        },
+        "threads": sorted(t.name for t in threading.enumerate()),
+        "connection_pool": pool_state,
+    }
@@ -0,0 +1,19 @@
+from fastapi import HTTPException
+
+
+def parse_fields(fields, available):
+    """
+    Parses a comma separated `fields` query parameter into the frozenset of
+    requested keys out of `available`. An empty parameter requests every key.
+    """
+    if fields == "":
+        return frozenset(available)
+
+    requested = frozenset(f.strip() for f in fields.split(",") if f.strip() != "")
+    unknown = requested - set(available)
+    if unknown or not requested:
+        raise HTTPException(
+            status_code=400,
+            detail=f"fields must be a comma separated list of: {', '.join(available)}",
+        )
+    return requested
@@ -1,14 +1,56 @@
+import functools
+
 import sqlalchemy
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Response
 from fastapi.params import Query
 from src import database as db
+from src.api.fields import parse_fields
+from src.counts import set_total_headers, totals
+from src.singleflight import flight
 
 router = APIRouter()
 
+# Statements are built once at import time with bound parameters, see
+# src/api/characters.py.
+line_id_param = sqlalchemy.bindparam("line_id")
+
+# output key -> column of each line returned by get_line
+LINE_FIELDS = {
+    "movie": db.movies.c.title,
+    "spoken_by": db.characters.c.name,
+    "conversation_id": db.lines.c.conversation_id,
+    "line": db.lines.c.line_text,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def line_stmt(fields):
+    """
+    Returns the statement selecting the `fields` of a line, joining movies and
+    characters only when a field from them is requested.
+    """
+    select_from = db.lines
+    if "movie" in fields:
+        select_from = select_from.join(db.movies, db.movies.c.movie_id == db.lines.c.movie_id)
+    if "spoken_by" in fields:
+        select_from = select_from.join(
+            db.characters, db.characters.c.character_id == db.lines.c.character_id
+        )
+
+    return (
+        sqlalchemy.select(*[LINE_FIELDS[key].label(key) for key in LINE_FIELDS if key in fields])
+        .select_from(select_from)
+        .where(
+            db.lines.c.line_id == line_id_param
+        )
+    )
+
 
 @router.get("/lines/{id}", tags=["lines"])
+@flight.coalesce
 def get_line(
-        id: int
+        id: int,
+        fields: str = "",
 ):
     """
         This endpoint returns a full line. Each line includes
@@ -16,45 +58,79 @@ def get_line(
         * 'spoken_by': the character that says the line
         * 'conversation_id': the id of the conversation in which this line takes place
         * 'line': the full text of the line
+
+        You can pick which of these keys are returned with the `fields` query
+        parameter, a comma separated list such as `fields=line,spoken_by`. Keys
+        that are not requested are not queried.
         """
+    fields = parse_fields(fields, LINE_FIELDS)
 
-    stmt = (
-        sqlalchemy.select(
-            db.lines.c.line_id,
-            db.movies.c.title,
-            db.lines.c.conversation_id,
-            db.lines.c.line_text,
-            db.characters.c.name
-        )
-        .select_from(
-            db.lines
-            .join(db.movies, db.movies.c.movie_id == db.lines.c.movie_id)
-            .join(db.characters, db.characters.c.character_id == db.lines.c.character_id)
-            .join(db.conversations, db.conversations.c.conversation_id == db.lines.c.conversation_id))
-        .where(
-            db.lines.c.line_id == id
+    with db.connect("get_line") as conn:
+        result = conn.execute(line_stmt(fields), {"line_id": id}).fetchone()
+        if result is None:
+            raise HTTPException(status_code=404, detail="line not found.")
+        return dict(result._mapping)
+
+
+# output key -> column of each line returned by get_lines
+LINES_FIELDS = {
+    "movie_title": db.movies.c.title,
+    "character_name": db.characters.c.name,
+    "line": db.lines.c.line_text,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def list_lines_stmt(character_filtered, movie_filtered, fields=frozenset(LINES_FIELDS)):
+    """
+    Returns the list statement selecting `fields`, filtered by the `character`
+    and `movie` bound parameters when the matching flag is set. Characters
+    and movies are only joined when filtered on or a field from them is
+    requested, otherwise an EXISTS keeps the same rows as the join would.
+    Lines are unique by primary key and the joins are many to one, so no
+    GROUP BY is needed.
+    """
+    select_from = db.lines
+    exists = []
+    if character_filtered or "character_name" in fields:
+        select_from = select_from.join(
+            db.characters, db.characters.c.character_id == db.lines.c.character_id
         )
+    else:
+        exists.append(sqlalchemy.exists().where(db.characters.c.character_id == db.lines.c.character_id))
+    if movie_filtered or "movie_title" in fields:
+        select_from = select_from.join(db.movies, db.movies.c.movie_id == db.lines.c.movie_id)
+    else:
+        exists.append(sqlalchemy.exists().where(db.movies.c.movie_id == db.lines.c.movie_id))
+
+    stmt = (
+        sqlalchemy.select(*[LINES_FIELDS[key].label(key) for key in LINES_FIELDS if key in fields])
+        .select_from(select_from)
+        .limit(sqlalchemy.bindparam("limit"))
+        .offset(sqlalchemy.bindparam("offset"))
+        .order_by(db.lines.c.line_id, db.lines.c.line_sort)
     )
+    for clause in exists:
+        stmt = stmt.where(clause)
 
-    with db.engine.connect() as conn:
-        result = conn.execute(stmt).fetchone()
-        if result is None:
-            raise HTTPException(status_code=404, detail="line not found.")
-        return {
-            "movie": result.title,
-            "spoken_by": result.name,
-            "conversation_id": result.conversation_id,
-            "line": result.line_text
+    # filter only if name parameter is passed
+    if character_filtered:
+        stmt = stmt.where(db.characters.c.name.ilike(sqlalchemy.bindparam("character")))
+    if movie_filtered:
+        stmt = stmt.where(db.movies.c.title.ilike(sqlalchemy.bindparam("movie")))
 
-        }
+    return stmt
 
 
 @router.get("/lines/", tags=["lines"])
 def get_lines(
+        response: Response,
         character: str = "",
         movie: str = "",
         limit: int = Query(50, ge=1, le=250),
         offset: int = Query(0, ge=0),
+        count: bool = False,
+        fields: str = "",
 ):
     """
     This endpoint returns a list of lines. For each line it returns:
@@ -64,46 +140,35 @@ def get_lines(
 
     This endpoint allows filtering based on the 'movie' or 'character' parameters
 
+    You can pick which of these keys are returned with the `fields` query
+    parameter, a comma separated list such as `fields=line`. Keys that are not
+    requested are not queried.
+
     The `limit` and `offset` query
     parameters are used for pagination. The `limit` query parameter specifies the
     maximum number of results to return. The `offset` query parameter specifies the
     number of results to skip before returning results.
-    """
-    stmt = (
-        sqlalchemy.select(
-            db.lines.c.line_id,
-            db.movies.c.title,
-            db.lines.c.line_text,
-            db.characters.c.name
-        )
-        .select_from(db.lines.join(db.characters).join(db.movies))
-        .limit(limit)
-        .offset(offset)
-        .order_by(db.lines.c.line_id, db.lines.c.line_sort)
-        .group_by(
-            db.lines.c.line_id,
-            db.movies.c.title,
-            db.characters.c.name,
-            db.lines.c.line_text
-        )
-    )
 
-    # filter only if name parameter is passed
+    Passing `count=true` adds the total number of results to the
+    `X-Total-Count` response header. `X-Total-Count-Exact` is `false` when the
+    total is the database's estimate, which can be the case for filtered lists.
+    """
+    fields = parse_fields(fields, LINES_FIELDS)
+    params = {"limit": limit, "offset": offset}
     if character != "":
-        stmt = stmt.where(db.characters.c.name.ilike(f"%{character}%"))
+        params["character"] = f"%{character}%"
     if movie != "":
-        stmt = stmt.where(db.movies.c.title.ilike(f"%{movie}%"))
-
-    with db.engine.connect() as conn:
-        result = conn.execute(stmt)
-        json = []
-        for row in result:
-            json.append(
-                {
-                    "movie_title": row.title,
-                    "character_name": row.name,
-                    "line": row.line_text,
-                }
+        params["movie"] = f"%{movie}%"
+
+    stmt = list_lines_stmt(character != "", movie != "", fields)
+    with db.connect("get_lines") as conn:
+        result = conn.execute(stmt, params)
+        json = [dict(row._mapping) for row in result]
+
+        if count:
+            total, exact = totals.total(
+                conn, "lines", stmt, params, character != "" or movie != "", offset, len(json), limit
             )
+            set_total_headers(response, total, exact)
 
     return json
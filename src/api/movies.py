@@ -1,14 +1,53 @@
+import functools
+
 import sqlalchemy
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Response
 from enum import Enum
 from fastapi.params import Query
 
 from src import database as db
+from src.api.fields import parse_fields
+from src.counts import set_total_headers, totals
+from src import snapshot
+from src.singleflight import flight
 
 router = APIRouter()
 
+# Statements are built once at import time with bound parameters, see
+# src/api/characters.py.
+movie_id_param = sqlalchemy.bindparam("movie_id")
+
+movie_stmt = (
+    sqlalchemy.select(
+        db.movies.c.movie_id,
+        db.movies.c.title,
+    )
+    .where(
+        db.movies.c.movie_id == movie_id_param
+    )
+)
+
+top_characters_stmt = (
+    sqlalchemy.select(
+        db.characters.c.character_id,
+        db.characters.c.name,
+        sqlalchemy.func.count(db.lines.c.character_id).label("num_lines")
+    )
+    .select_from(db.characters.join(db.lines))
+    .where(
+        db.characters.c.movie_id == movie_id_param
+    )
+    .order_by(
+        sqlalchemy.desc("num_lines")
+    )
+    .group_by(
+        db.characters.c.character_id
+    )
+)
+
 
 @router.get("/movies/{movie_id}", tags=["movies"])
+@flight.coalesce
 def get_movie(movie_id: int):
     """
     This endpoint returns a single movie by its identifier. For each movie it returns:
@@ -24,42 +63,21 @@ def get_movie(movie_id: int):
     * `num_lines`: The number of lines the character has in the movie.
 
     """
-    json = None
-
-    stmt1 = (
-        sqlalchemy.select(
-            db.movies.c.movie_id,
-            db.movies.c.title,
-        )
-        .where(
-            db.movies.c.movie_id == movie_id
-        )
-    )
-
-    stmt2 = (
-        sqlalchemy.select(
-            db.characters.c.character_id,
-            db.characters.c.name,
-            sqlalchemy.func.count(db.lines.c.character_id).label("num_lines")
-        )
-        .select_from(db.characters.join(db.lines))
-        .where(
-            db.characters.c.movie_id == movie_id
-        )
-        .order_by(
-            sqlalchemy.desc("num_lines")
-        )
-        .group_by(
-            db.characters.c.character_id
-        )
-    )
+    # served from the shared memory-mapped snapshot when running under serve.py
+    corpus = snapshot.current()
+    if corpus is not None:
+        json = corpus.get_movie(movie_id)
+        if json is None:
+            raise HTTPException(status_code=404, detail="movie not found.")
+        return json
 
-    with db.engine.connect() as conn:
-        movie_result = conn.execute(stmt1).fetchone()
+    with db.connect("get_movie") as conn:
+        params = {"movie_id": movie_id}
+        movie_result = conn.execute(movie_stmt, params).fetchone()
         if movie_result is None:
             raise HTTPException(status_code=404, detail="movie not found.")
 
-        characters_result = conn.execute(stmt2)
+        characters_result = conn.execute(top_characters_stmt, params)
         top_characters = []
         for character in characters_result:
             top_characters.append({
@@ -83,13 +101,57 @@ class movie_sort_options(str, Enum):
     rating = "rating"
 
 
+# output key -> column of each movie returned by list_movies
+LIST_MOVIE_FIELDS = {
+    "movie_id": db.movies.c.movie_id,
+    "movie_title": db.movies.c.title,
+    "year": db.movies.c.year,
+    "imdb_rating": db.movies.c.imdb_rating,
+    "imdb_votes": db.movies.c.imdb_votes,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def list_movies_stmt(sort, filtered, fields=frozenset(LIST_MOVIE_FIELDS)):
+    """
+    Returns the list statement for a sort option selecting `fields`, filtered
+    by the `name` bound parameter when `filtered` is set.
+    """
+    if sort is movie_sort_options.movie_title:
+        order_by = db.movies.c.title
+    elif sort is movie_sort_options.year:
+        order_by = db.movies.c.year
+    elif sort is movie_sort_options.rating:
+        order_by = sqlalchemy.desc(db.movies.c.imdb_rating)
+    else:
+        assert False
+
+    stmt = (
+        sqlalchemy.select(
+            *[LIST_MOVIE_FIELDS[key].label(key) for key in LIST_MOVIE_FIELDS if key in fields]
+        )
+        .limit(sqlalchemy.bindparam("limit"))
+        .offset(sqlalchemy.bindparam("offset"))
+        .order_by(order_by, db.movies.c.movie_id)
+    )
+
+    # filter only if name parameter is passed
+    if filtered:
+        stmt = stmt.where(db.movies.c.title.ilike(sqlalchemy.bindparam("name")))
+
+    return stmt
+
+
 # Add get parameters
 @router.get("/movies/", tags=["movies"])
 def list_movies(
+    response: Response,
     name: str = "",
     limit: int = Query(50, ge=1, le=250),
     offset: int = Query(0, ge=0),
     sort: movie_sort_options = movie_sort_options.movie_title,
+    count: bool = False,
+    fields: str = "",
 ):
     """
     This endpoint returns a list of movies. For each movie it returns:
@@ -108,49 +170,32 @@ def list_movies(
     * `year` - Sort by year of release, earliest to latest.
     * `rating` - Sort by rating, highest to lowest.
 
+    You can pick which keys are returned with the `fields` query parameter, a
+    comma separated list such as `fields=movie_id,movie_title`.
+
     The `limit` and `offset` query
     parameters are used for pagination. The `limit` query parameter specifies the
     maximum number of results to return. The `offset` query parameter specifies the
     number of results to skip before returning results.
+
+    Passing `count=true` adds the total number of results to the
+    `X-Total-Count` response header. `X-Total-Count-Exact` is `false` when the
+    total is the database's estimate, which can be the case for filtered lists.
     """
-    if sort is movie_sort_options.movie_title:
-        order_by = db.movies.c.title
-    elif sort is movie_sort_options.year:
-        order_by = db.movies.c.year
-    elif sort is movie_sort_options.rating:
-        order_by = sqlalchemy.desc(db.movies.c.imdb_rating)
-    else:
-        assert False
+    fields = parse_fields(fields, LIST_MOVIE_FIELDS)
+    params = {"limit": limit, "offset": offset}
+    if name != "":
+        params["name"] = f"%{name}%"
 
-    stmt = (
-        sqlalchemy.select(
-            db.movies.c.movie_id,
-            db.movies.c.title,
-            db.movies.c.year,
-            db.movies.c.imdb_rating,
-            db.movies.c.imdb_votes,
-        )
-        .limit(limit)
-        .offset(offset)
-        .order_by(order_by, db.movies.c.movie_id)
-    )
+    stmt = list_movies_stmt(sort, name != "", fields)
+    with db.connect("list_movies") as conn:
+        result = conn.execute(stmt, params)
+        json = [dict(row._mapping) for row in result]
 
-    # filter only if name parameter is passed
-    if name != "":
-        stmt = stmt.where(db.movies.c.title.ilike(f"%{name}%"))
-
-    with db.engine.connect() as conn:
-        result = conn.execute(stmt)
-        json = []
-        for row in result:
-            json.append(
-                {
-                    "movie_id": row.movie_id,
-                    "movie_title": row.title,
-                    "year": row.year,
-                    "imdb_rating": row.imdb_rating,
-                    "imdb_votes": row.imdb_votes,
-                }
+        if count:
+            total, exact = totals.total(
+                conn, "movies", stmt, params, name != "", offset, len(json), limit
             )
+            set_total_headers(response, total, exact)
 
     return json
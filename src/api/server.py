@@ -1,5 +1,15 @@
-from fastapi import FastAPI
-from src.api import characters, movies, lines, conversations, pkg_util
+import os
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from src.admission import AdmissionMiddleware, PriorityClass
+from src import capture, snapshot
+from src.capture import CaptureMiddleware
+from src.compression import CompressionMiddleware
+from src.deadlines import CancelOnDisconnectMiddleware, DeadlineExceeded, RequestCancelled
+from src.similarity import similarity_index
+from src.singleflight import flight
+from src.api import characters, movies, lines, conversations, diagnostics, analytics, autocomplete
 
 description = """
 Movie API returns dialog statistics on top hollywood movies from decades past.
@@ -15,6 +25,16 @@ You can:
 You can:
 * **list movies with sorting and filtering options.**
 * **retrieve a specific movie by id**
+
+## Analytics
+
+You can:
+* **group and filter dialogue volume by movie year, rating, character gender and age**
+
+## Autocomplete
+
+You can:
+* **search movie titles and character names by prefix, most popular first**
 """
 tags_metadata = [
     {
@@ -25,6 +45,14 @@ tags_metadata = [
         "name": "movies",
         "description": "Access information on top-rated movies.",
     },
+    {
+        "name": "analytics",
+        "description": "Aggregate dialogue statistics across movies and characters.",
+    },
+    {
+        "name": "autocomplete",
+        "description": "Prefix search over movie titles and character names.",
+    },
 ]
 
 app = FastAPI(
@@ -37,13 +65,127 @@ app = FastAPI(
     },
     openapi_tags=tags_metadata,
 )
+
+# Cancels the running queries of requests whose client went away. Added
+# first so it sits inside admission control and only wraps admitted requests.
+app.add_middleware(CancelOnDisconnectMiddleware)
+
+# Response compression, zstd or brotli when installed and gzip otherwise.
+# COMPRESSION_MINIMUM_SIZE and COMPRESSION_<ENCODING>_LEVEL (GZIP, BR, ZSTD)
+# override the defaults, levels are capped in src/compression.py.
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.environ.get("COMPRESSION_MINIMUM_SIZE", 1024)),
+    levels={
+        name: int(os.environ[f"COMPRESSION_{name.upper()}_LEVEL"])
+        for name in ("gzip", "br", "zstd")
+        if f"COMPRESSION_{name.upper()}_LEVEL" in os.environ
+    },
+)
+
+# Admission control. Every request is assigned a priority class by route and
+# each class gets its own slice of the threadpool and connection pool, so the
+# expensive aggregates can pile up without starving the cheap lookups. Sizes
+# can be overridden with ADMISSION_<CLASS>_CONCURRENCY / _QUEUE_DEPTH /
+# _QUEUE_TIMEOUT / _RETRY_AFTER environment variables. Requests identical to
+# one already running wait on it through `flight` instead of taking a slot.
+admission_classes = [
+    # primary key lookups and static routes
+    PriorityClass.from_env("high", concurrency=16, queue_depth=64),
+    # list endpoints, writes and in-memory analytics
+    PriorityClass.from_env("normal", concurrency=12, queue_depth=32),
+    # multi-level GROUP BY aggregates
+    PriorityClass.from_env("low", concurrency=6, queue_depth=12, retry_after=2),
+]
+admission_rules = [
+    ("GET", r"/characters/\d+", "low"),
+    ("GET", r"/movies/\d+", "normal"),
+    ("GET", r"/lines/\d+", "high"),
+    ("GET", r"/conversations/\d+", "high"),
+    ("GET", r"/autocomplete/?", "high"),
+    ("GET", r"/(metrics/)?", "high"),
+    # diagnostics must get through under the load they are diagnosing
+    ("GET", r"/diagnostics/.*", "high"),
+    ("POST", r"/diagnostics/.*", "high"),
+    ("DELETE", r"/diagnostics/.*", "high"),
+]
+app.add_middleware(
+    AdmissionMiddleware,
+    classes=admission_classes,
+    rules=admission_rules,
+    default="normal",
+    flight=flight,
+)
+
+# Traffic capture for benchmarks/replay.py, off unless CAPTURE_PATH is set.
+# Added last so it is the outermost middleware and records shed requests and
+# the full latency too.
+if os.environ.get("CAPTURE_PATH"):
+    app.add_middleware(
+        CaptureMiddleware,
+        path=os.environ["CAPTURE_PATH"],
+        sample_rate=float(os.environ.get("CAPTURE_SAMPLE_RATE", 1.0)),
+    )
+
 app.include_router(characters.router)
 app.include_router(movies.router)
 app.include_router(lines.router)
-app.include_router(pkg_util.router)
+app.include_router(diagnostics.router)
 app.include_router(conversations.router)
+app.include_router(analytics.router)
+app.include_router(autocomplete.router)
+
+
+@app.on_event("startup")
+def watch_snapshot():
+    # Drops this worker's read models whenever a write swaps the snapshot.
+    # Registered first so the snapshot is open before they are built.
+    snapshot.start_watching()
+
+
+@app.on_event("startup")
+def build_indexes():
+    # Scans every line, so it runs in the background instead of on the
+    # first /characters/{id}/similar request.
+    similarity_index.start_build()
+
+
+@app.on_event("shutdown")
+def flush_capture():
+    # queued capture records are written out instead of lost
+    capture.shutdown()
+
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded):
+    return JSONResponse(
+        status_code=504,
+        content={
+            "detail": "query deadline exceeded",
+            "route": exc.route,
+            "deadline_ms": exc.deadline_ms,
+            "elapsed_ms": exc.elapsed_ms,
+        },
+    )
+
+
+@app.exception_handler(RequestCancelled)
+async def request_cancelled_handler(request: Request, exc: RequestCancelled):
+    # Nobody is left to read this, 499 is nginx's "client closed request".
+    return JSONResponse(
+        status_code=499,
+        content={"detail": "client disconnected", "route": exc.route},
+    )
 
 
 @app.get("/")
 async def root():
     return {"message": "Welcome to the Movie API. See /docs for more information."}
+
+
+@app.get("/metrics/")
+def metrics():
+    return {
+        "coalescing": flight.stats(),
+        "admission": {c.name: c.stats() for c in admission_classes},
+    }
@@ -0,0 +1,164 @@
+import bisect
+import collections
+import heapq
+import threading
+
+import sqlalchemy
+
+from src import database as db
+
+# Prefixes up to this length match so many entries that their results are
+# cached until the next write.
+CACHED_PREFIX_LENGTH = 2
+
+
+class PrefixIndex:
+    """
+    Prefix search over movie titles and character names.
+
+    Every title and name is indexed under its full lowercased text and under
+    the text starting at each later word, so `mat` finds `the matrix`. The
+    keys are kept in one sorted list and a prefix is answered with two
+    binary searches, then ranked by popularity: imdb votes for movies and
+    number of lines for characters. The two scales are far apart, so items
+    are ranked by the percentile of their popularity within their own kind.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built = False
+        self._keys = []
+        self._key_items = []
+        # item index -> dict returned to the client, including its popularity
+        self._items = []
+        self._character_items = {}
+        # kind -> sorted popularity of every item of that kind
+        self._popularity = {}
+        self._cache = {}
+
+    def _build(self):
+        line_counts = (
+            sqlalchemy.select(
+                db.lines.c.character_id,
+                sqlalchemy.func.count(db.lines.c.line_id).label("number_of_lines"),
+            )
+            .group_by(db.lines.c.character_id)
+            .subquery()
+        )
+        characters_stmt = (
+            sqlalchemy.select(
+                db.characters.c.character_id,
+                db.characters.c.name,
+                db.movies.c.title,
+                sqlalchemy.func.coalesce(line_counts.c.number_of_lines, 0).label("number_of_lines"),
+            )
+            .select_from(db.characters.join(db.movies).outerjoin(line_counts))
+        )
+        movies_stmt = sqlalchemy.select(
+            db.movies.c.movie_id,
+            db.movies.c.title,
+            db.movies.c.imdb_votes,
+        )
+
+        items = []
+        character_items = {}
+        with db.engine.connect() as conn:
+            for row in conn.execute(movies_stmt):
+                items.append({
+                    "kind": "movie",
+                    "id": row.movie_id,
+                    "label": row.title,
+                    "popularity": row.imdb_votes or 0,
+                })
+            for row in conn.execute(characters_stmt):
+                character_items[row.character_id] = len(items)
+                items.append({
+                    "kind": "character",
+                    "id": row.character_id,
+                    "label": row.name,
+                    "movie": row.title,
+                    "popularity": row.number_of_lines,
+                })
+
+        entries = []
+        for i, item in enumerate(items):
+            if not item["label"]:
+                continue
+            text = item["label"].lower()
+            for start, char in enumerate(text):
+                if start == 0 or (text[start - 1] == " " and char != " "):
+                    entries.append((text[start:], i))
+        entries.sort()
+
+        popularity = collections.defaultdict(list)
+        for item in items:
+            popularity[item["kind"]].append(item["popularity"])
+
+        self._keys = [key for key, _ in entries]
+        self._key_items = [i for _, i in entries]
+        self._items = items
+        self._character_items = character_items
+        self._popularity = {kind: sorted(values) for kind, values in popularity.items()}
+        self._cache = {}
+        self._built = True
+
+    def ensure_built(self):
+        with self._lock:
+            if not self._built:
+                self._build()
+
+    def invalidate(self):
+        """Drop the index so it is rebuilt from the database on next use."""
+        with self._lock:
+            self._built = False
+
+    def record_lines(self, character_ids):
+        """Adds one line of popularity per entry of `character_ids`."""
+        with self._lock:
+            if not self._built:
+                return
+            for character_id in character_ids:
+                i = self._character_items.get(character_id)
+                if i is not None:
+                    item = self._items[i]
+                    values = self._popularity[item["kind"]]
+                    del values[bisect.bisect_left(values, item["popularity"])]
+                    item["popularity"] += 1
+                    bisect.insort(values, item["popularity"])
+            self._cache = {}
+
+    def _rank(self, item):
+        """The fraction of items of the same kind at most as popular as `item`."""
+        values = self._popularity[item["kind"]]
+        return bisect.bisect_right(values, item["popularity"]) / len(values)
+
+    def search(self, query, limit, kind=None):
+        """Returns up to `limit` of the most popular items matching `query`."""
+        self.ensure_built()
+        prefix = query.lower().strip()
+        if not prefix:
+            return []
+
+        cache_key = (prefix, limit, kind)
+        with self._lock:
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+            start = bisect.bisect_left(self._keys, prefix)
+            end = bisect.bisect_left(self._keys, prefix + "\uffff", start)
+            matches = {
+                self._key_items[i]
+                for i in range(start, end)
+                if kind is None or self._items[self._key_items[i]]["kind"] == kind
+            }
+            ranks = {i: self._rank(self._items[i]) for i in matches}
+            top = heapq.nlargest(limit, matches, key=lambda i: (ranks[i], -i))
+            result = [dict(self._items[i], rank=round(ranks[i], 4)) for i in top]
+
+            if len(prefix) <= CACHED_PREFIX_LENGTH:
+                self._cache[cache_key] = result
+            return result
+
+
+prefix_index = PrefixIndex()
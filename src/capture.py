@@ -0,0 +1,110 @@
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import time
+
+# Request bodies larger than this are recorded as null.
+MAX_BODY_BYTES = 64 * 1024
+
+
+# path -> (listener, queue handler) of every capture logger, see `shutdown`
+_listeners = {}
+
+
+def capture_logger(path, max_bytes, backup_count):
+    """
+    Returns a logger writing one JSON object per line to `path`, rotated at
+    `max_bytes`. Records are handed to a background thread, so a request only
+    pays for putting the record on a queue.
+    """
+    logger = logging.getLogger(f"movie_api.capture.{path}")
+    if path in _listeners:
+        return logger
+
+    handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+    )
+    handler.setFormatter(logging.Formatter("%(message)s"))
+
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, handler)
+    listener.start()
+
+    queue_handler = logging.handlers.QueueHandler(records)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    logger.addHandler(queue_handler)
+    _listeners[path] = (listener, queue_handler)
+    return logger
+
+
+def shutdown():
+    """Writes out the records still queued and stops the capture threads."""
+    for path, (listener, queue_handler) in list(_listeners.items()):
+        logging.getLogger(f"movie_api.capture.{path}").removeHandler(queue_handler)
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+        del _listeners[path]
+
+
+class CaptureMiddleware:
+    """
+    ASGI middleware recording a sample of requests as JSONL for
+    benchmarks/replay.py. Each line holds the request's arrival time, method,
+    path, query string, body, response status and latency in milliseconds.
+
+    `sample_rate` is the fraction of requests recorded. Requests that are not
+    sampled are passed straight through.
+    """
+
+    def __init__(self, app, path, sample_rate=1.0, max_bytes=50 * 1024 * 1024, backup_count=5):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.logger = capture_logger(path, max_bytes, backup_count)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or random.random() >= self.sample_rate:
+            await self.app(scope, receive, send)
+            return
+
+        started_at = time.time()
+        start = time.perf_counter()
+        body = []
+        body_size = 0
+        status = None
+
+        async def capture_receive():
+            nonlocal body, body_size
+            message = await receive()
+            if message["type"] == "http.request" and body is not None:
+                chunk = message.get("body", b"")
+                body_size += len(chunk)
+                if body_size > MAX_BODY_BYTES:
+                    # too large to record, stop holding on to it
+                    body = None
+                else:
+                    body.append(chunk)
+            return message
+
+        async def capture_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, capture_receive, capture_send)
+        finally:
+            raw_body = None if body is None else b"".join(body)
+            self.logger.info(json.dumps({
+                "ts": started_at,
+                "method": scope["method"],
+                "path": scope["path"],
+                "query": scope["query_string"].decode("latin-1"),
+                "body": None if raw_body is None else raw_body.decode("utf-8", "replace"),
+                "status": status,
+                "latency_ms": round((time.perf_counter() - start) * 1000, 3),
+            }))
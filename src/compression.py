@@ -0,0 +1,211 @@
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Responses smaller than this are sent as is, compressing them saves a few
+# bytes at best and costs more than it saves.
+DEFAULT_MINIMUM_SIZE = 1024
+# Highest level used per encoding, whatever is configured. Above these the
+# CPU cost keeps growing for a ratio that barely improves on JSON.
+MAX_LEVELS = {"zstd": 6, "br": 5, "gzip": 6}
+DEFAULT_LEVELS = {"zstd": 3, "br": 4, "gzip": 5}
+
+# Content types worth compressing, anything else (images, already compressed
+# archives) is passed through.
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+
+class GzipEncoder:
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        """Emits everything compressed so far, for streamed responses."""
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliEncoder:
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class ZstdEncoder:
+    def __init__(self, level):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+# Encodings in order of preference, only those whose library is installed.
+ENCODERS = {}
+if zstandard is not None:
+    ENCODERS["zstd"] = ZstdEncoder
+if brotli is not None:
+    ENCODERS["br"] = BrotliEncoder
+ENCODERS["gzip"] = GzipEncoder
+
+
+def negotiate(accept_encoding, available=ENCODERS):
+    """
+    Picks the preferred encoding of `available` accepted by an
+    Accept-Encoding header, or None. Encodings with q=0 are refused, `*`
+    accepts any encoding not listed explicitly.
+    """
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.strip()] = q
+
+    for name in available:
+        if accepted.get(name, accepted.get("*", 0.0)) > 0:
+            return name
+    return None
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing responses with the best encoding the client
+    accepts: zstd or brotli when installed, otherwise gzip.
+
+    Responses under `minimum_size` bytes are sent untouched. Streamed
+    responses are buffered only until they reach `minimum_size`, then each
+    chunk is compressed and flushed as it comes so NDJSON transcripts keep
+    streaming. Levels are capped at MAX_LEVELS.
+    """
+
+    def __init__(self, app, minimum_size=DEFAULT_MINIMUM_SIZE, levels=None):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.levels = {
+            name: min(level, MAX_LEVELS[name])
+            for name, level in {**DEFAULT_LEVELS, **(levels or {})}.items()
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = ""
+        for key, value in scope["headers"]:
+            if key == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+                break
+        encoding = negotiate(accept_encoding) if accept_encoding else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressingResponder(send, encoding, self.levels[encoding], self.minimum_size)
+        await self.app(scope, receive, responder)
+
+
+class _CompressingResponder:
+    def __init__(self, send, encoding, level, minimum_size):
+        self.send = send
+        self.encoding = encoding
+        self.level = level
+        self.minimum_size = minimum_size
+        self.start = None
+        self.passthrough = False
+        self.encoder = None
+        self.buffer = []
+        self.buffered = 0
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            self.start = message
+            headers = {key.lower(): value for key, value in message.get("headers", [])}
+            content_type = headers.get(b"content-type", b"").decode("latin-1")
+            self.passthrough = (
+                b"content-encoding" in headers
+                or message["status"] < 200
+                or message["status"] in (204, 304)
+                or not content_type.startswith(COMPRESSIBLE_TYPES)
+            )
+            if self.passthrough:
+                await self.send(message)
+            return
+
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.encoder is not None:
+            data = self.encoder.compress(body)
+            data += self.encoder.flush() if more_body else self.encoder.finish()
+            await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
+            return
+
+        self.buffer.append(body)
+        self.buffered += len(body)
+        if self.buffered < self.minimum_size:
+            if more_body:
+                return
+            # too small to be worth it, send it as the app produced it
+            self.passthrough = True
+            await self.send(self.start)
+            await self.send({"type": "http.response.body", "body": b"".join(self.buffer)})
+            return
+
+        self.encoder = ENCODERS[self.encoding](self.level)
+        data = self.encoder.compress(b"".join(self.buffer))
+        self.buffer = []
+        data += self.encoder.flush() if more_body else self.encoder.finish()
+
+        headers = [
+            (key, value)
+            for key, value in self.start.get("headers", [])
+            if key.lower() not in (b"content-length", b"vary")
+        ]
+        vary = b", ".join(value for key, value in self.start.get("headers", []) if key.lower() == b"vary")
+        if b"accept-encoding" not in vary.lower():
+            vary = vary + b", Accept-Encoding" if vary else b"Accept-Encoding"
+        headers.append((b"content-encoding", self.encoding.encode("latin-1")))
+        headers.append((b"vary", vary))
+        if not more_body:
+            headers.append((b"content-length", str(len(data)).encode("latin-1")))
+
+        await self.send({**self.start, "headers": headers})
+        await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
@@ -0,0 +1,97 @@
+import json
+import threading
+
+import sqlalchemy
+
+from src import database as db
+
+
+class TotalCounts:
+    """
+    Total row counts for the list endpoints without COUNT(*) scans per
+    request.
+
+    Unfiltered totals are counted once and then maintained in memory by
+    `record_lines`. Filtered totals are the planner's row estimate for the
+    query, which costs planning but no execution.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._movies = 0
+        self._lines = 0
+        # characters with at least one line, the rows of list_characters
+        self._speaking_characters = set()
+
+    def _load(self):
+        with db.engine.connect() as conn:
+            self._movies = conn.execute(
+                sqlalchemy.select(sqlalchemy.func.count()).select_from(db.movies)
+            ).scalar()
+            self._lines = conn.execute(
+                sqlalchemy.select(sqlalchemy.func.count()).select_from(db.lines)
+            ).scalar()
+            self._speaking_characters = set(conn.execute(
+                sqlalchemy.select(db.lines.c.character_id).distinct()
+            ).scalars())
+        self._loaded = True
+
+    def exact(self, table):
+        """Returns the maintained total of `table`, one of movies, characters or lines."""
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            if table == "movies":
+                return self._movies
+            if table == "characters":
+                return len(self._speaking_characters)
+            if table == "lines":
+                return self._lines
+            raise ValueError(table)
+
+    def invalidate(self):
+        """Drop the maintained totals so they are counted again on next use."""
+        with self._lock:
+            self._loaded = False
+
+    def record_lines(self, character_ids):
+        """Adds one line per entry of `character_ids` to the maintained totals."""
+        with self._lock:
+            if not self._loaded:
+                return
+            for character_id in character_ids:
+                self._lines += 1
+                self._speaking_characters.add(character_id)
+
+    def estimate(self, conn, stmt, params):
+        """Returns the planner's estimate of the number of rows `stmt` returns."""
+        stmt = stmt.limit(None).offset(None).order_by(None)
+        compiled = stmt.compile(dialect=conn.dialect)
+        plan = conn.exec_driver_sql(
+            "EXPLAIN (FORMAT JSON) " + str(compiled), compiled.construct_params(params)
+        ).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+    def total(self, conn, table, stmt, params, filtered, offset, returned, limit):
+        """
+        Returns (total, exact) for a page of a list endpoint. A short page
+        already tells the exact total, otherwise unfiltered lists use the
+        maintained totals and filtered lists the planner estimate.
+        """
+        if returned < limit and (returned > 0 or offset == 0):
+            return offset + returned, True
+        if not filtered:
+            return self.exact(table), True
+        # an estimate can never be below what has been seen already
+        return max(self.estimate(conn, stmt, params), offset + returned), False
+
+
+totals = TotalCounts()
+
+
+def set_total_headers(response, total, exact):
+    response.headers["X-Total-Count"] = str(total)
+    response.headers["X-Total-Count-Exact"] = "true" if exact else "false"
@@ -0,0 +1,156 @@
+import math
+import threading
+
+import sqlalchemy
+
+from src import database as db
+
+# Dimensions the cube is aggregated over. The order here is the order of the
+# values in each cell key.
+DIMENSIONS = ("year", "rating", "gender", "age")
+
+
+def rating_bucket(imdb_rating):
+    """Bucket an imdb rating to its whole number, e.g. 6.9 -> 6."""
+    if imdb_rating is None:
+        return None
+    return int(math.floor(imdb_rating))
+
+
+class AnalyticsCube:
+    """
+    Line and speaking character counts pre-aggregated over movie year, imdb
+    rating bucket, character gender and character age.
+
+    The cube is built lazily on first use with two queries and afterwards kept
+    up to date in memory by `record_lines`, so answering a group-by never
+    touches the database. The build remembers the highest line_id it counted,
+    so lines committed before it and recorded after it are not counted twice.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (year, rating, gender, age) -> [number_of_lines, number_of_characters]
+        self._cells = None
+        # character_id -> (year, rating, gender, age)
+        self._character_dims = {}
+        # character_id -> number of lines spoken
+        self._character_lines = {}
+        # highest line_id counted by the build
+        self._last_line_id = None
+
+    def _build(self):
+        dims_stmt = sqlalchemy.select(
+            db.characters.c.character_id,
+            db.characters.c.gender,
+            db.characters.c.age,
+            db.movies.c.year,
+            db.movies.c.imdb_rating,
+        ).select_from(db.characters.join(db.movies))
+
+        # the high-water mark comes from the same statement as the counts, so
+        # both see the same committed lines
+        counts_stmt = sqlalchemy.select(
+            db.lines.c.character_id,
+            sqlalchemy.func.count(db.lines.c.line_id).label("number_of_lines"),
+            sqlalchemy.func.max(db.lines.c.line_id).label("last_line_id"),
+        ).group_by(db.lines.c.character_id)
+
+        with db.engine.connect() as conn:
+            character_dims = {
+                row.character_id: (
+                    row.year,
+                    rating_bucket(row.imdb_rating),
+                    row.gender,
+                    row.age,
+                )
+                for row in conn.execute(dims_stmt)
+            }
+            character_lines = {}
+            last_line_id = None
+            for row in conn.execute(counts_stmt):
+                character_lines[row.character_id] = row.number_of_lines
+                if last_line_id is None or row.last_line_id > last_line_id:
+                    last_line_id = row.last_line_id
+
+        cells = {}
+        for character_id, number_of_lines in character_lines.items():
+            key = character_dims.get(character_id)
+            if key is None:
+                continue
+            cell = cells.setdefault(key, [0, 0])
+            cell[0] += number_of_lines
+            cell[1] += 1
+
+        self._character_dims = character_dims
+        self._character_lines = character_lines
+        self._last_line_id = last_line_id
+        self._cells = cells
+
+    def ensure_built(self):
+        with self._lock:
+            if self._cells is None:
+                self._build()
+
+    def invalidate(self):
+        """Drop the cube so it is rebuilt from the database on next use."""
+        with self._lock:
+            self._cells = None
+
+    def record_lines(self, lines):
+        """
+        Incrementally add `lines`, (line_id, character_id) pairs, to the cube.
+        Called after new lines have been committed to the database. Lines the
+        build already counted are skipped.
+        """
+        with self._lock:
+            if self._cells is None:
+                # Not built yet, the next build will read the new lines.
+                return
+            for line_id, character_id in lines:
+                if self._last_line_id is not None and line_id <= self._last_line_id:
+                    continue
+                key = self._character_dims.get(character_id)
+                if key is None:
+                    # A character the cube has never seen, start over.
+                    self._cells = None
+                    return
+                cell = self._cells.setdefault(key, [0, 0])
+                cell[0] += 1
+                previous = self._character_lines.get(character_id, 0)
+                if previous == 0:
+                    cell[1] += 1
+                self._character_lines[character_id] = previous + 1
+
+    def query(self, group_by, filters):
+        """
+        Aggregate the cube by the dimensions in `group_by` keeping only the
+        cells matching every dimension -> value pair in `filters`. Filter
+        values are compared as strings so query parameters can be passed
+        straight through.
+        """
+        self.ensure_built()
+        group_idx = [DIMENSIONS.index(d) for d in group_by]
+        filter_idx = [(DIMENSIONS.index(d), str(v)) for d, v in filters.items()]
+
+        groups = {}
+        with self._lock:
+            for key, (number_of_lines, number_of_characters) in self._cells.items():
+                if any(str(key[i]) != value for i, value in filter_idx):
+                    continue
+                group_key = tuple(key[i] for i in group_idx)
+                group = groups.setdefault(group_key, [0, 0])
+                group[0] += number_of_lines
+                group[1] += number_of_characters
+
+        result = []
+        for group_key, (number_of_lines, number_of_characters) in groups.items():
+            row = dict(zip(group_by, group_key))
+            row["number_of_lines"] = number_of_lines
+            row["number_of_characters"] = number_of_characters
+            result.append(row)
+        result.sort(key=lambda r: r["number_of_lines"], reverse=True)
+        return result
+
+
+cube = AnalyticsCube()
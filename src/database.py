@@ -1,9 +1,12 @@
 import array
+import contextlib
 import csv
 import time
 
+import psycopg2.extensions
 import sqlalchemy
 
+from src import deadlines
 from src.datatypes import Character, Movie, Conversation, Line
 import os
 import io
@@ -19,7 +22,13 @@ DB_PORT: str = os.environ.get("POSTGRES_PORT")
 DB_NAME: str = os.environ.get("POSTGRES_DB")
 
 # Create a new DB engine based on our connection string
-engine = sqlalchemy.create_engine(f"postgresql://{DB_USER}:{DB_PASSWD}@{DB_SERVER}:{DB_PORT}/{DB_NAME}")
+# The pool is sized to cover the admission control concurrency limits in
+# src/api/server.py, so an admitted request never waits on a connection.
+engine = sqlalchemy.create_engine(
+    f"postgresql://{DB_USER}:{DB_PASSWD}@{DB_SERVER}:{DB_PORT}/{DB_NAME}",
+    pool_size=int(os.environ.get("POSTGRES_POOL_SIZE", 20)),
+    max_overflow=int(os.environ.get("POSTGRES_MAX_OVERFLOW", 15)),
+)
 
 # Create a single connection to the database. Later we will discuss pooling connections.
 conn = engine.connect()
@@ -30,3 +39,78 @@ characters = sqlalchemy.Table("characters", metadata_obj, autoload_with=engine)
 conversations = sqlalchemy.Table("conversations", metadata_obj, autoload_with=engine)
 lines = sqlalchemy.Table("lines", metadata_obj, autoload_with=engine)
 
+# Indexes are managed by the versioned migrations in src/migrations.py.
+
+
+@sqlalchemy.event.listens_for(engine, "before_cursor_execute")
+def apply_statement_timeout(conn, cursor, statement, parameters, context, executemany):
+    """
+    Sets the session's statement_timeout to the `deadline_ms` execution
+    option of the connection (see `connect`), or back to the default for
+    connections opened without one.
+
+    The applied value is kept in the pooled connection's info, so it is only
+    sent when it differs from what the connection last ran with, and the
+    primary key routes keep their single round trip.
+    """
+    timeout = conn.get_execution_options().get("deadline_ms")
+    if conn.info.get("statement_timeout") == timeout:
+        return
+
+    dbapi_connection = conn.connection.dbapi_connection
+    with dbapi_connection.cursor() as set_cursor:
+        if dbapi_connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            # a SET would be undone by a rollback, so only this transaction
+            # gets it and it is sent again next time
+            set_cursor.execute(
+                "SELECT set_config('statement_timeout', %s, true)",
+                (str(timeout or 0),),
+            )
+            return
+
+        # outside of a transaction, so a rollback does not undo it
+        dbapi_connection.autocommit = True
+        try:
+            if timeout is None:
+                set_cursor.execute("SET statement_timeout TO DEFAULT")
+            else:
+                set_cursor.execute("SET statement_timeout = %s", (timeout,))
+        finally:
+            dbapi_connection.autocommit = False
+    conn.info["statement_timeout"] = timeout
+
+
+@contextlib.contextmanager
+def connect(route):
+    """
+    Opens a connection for `route` whose statements are cancelled by Postgres
+    once they run past the route's deadline, see src/deadlines.py. The
+    connection is also registered with the current request so its query is
+    cancelled if the client disconnects.
+
+    Raises deadlines.DeadlineExceeded when a statement ran past the deadline
+    and deadlines.RequestCancelled when it was cancelled for a disconnect.
+    """
+    deadline_ms = deadlines.deadline_ms(route)
+    request_scope = deadlines.current_scope.get()
+    start = time.perf_counter()
+
+    with engine.connect() as conn:
+        # applied with the first statement, see apply_statement_timeout
+        conn.execution_options(deadline_ms=deadline_ms)
+        dbapi_connection = conn.connection.dbapi_connection
+        if request_scope is not None:
+            request_scope.register(dbapi_connection)
+        try:
+            yield conn
+        except sqlalchemy.exc.OperationalError as e:
+            # 57014 is query_canceled, raised for statement_timeout and cancel()
+            if getattr(e.orig, "pgcode", None) != "57014":
+                raise
+            if request_scope is not None and request_scope.disconnected:
+                raise deadlines.RequestCancelled(route) from e
+            elapsed_ms = round((time.perf_counter() - start) * 1000, 3)
+            raise deadlines.DeadlineExceeded(route, deadline_ms, elapsed_ms) from e
+        finally:
+            if request_scope is not None:
+                request_scope.unregister(dbapi_connection)
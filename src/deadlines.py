@@ -0,0 +1,115 @@
+import asyncio
+import contextvars
+import os
+import threading
+
+# Maximum time a single statement of a route may run, in milliseconds. Each
+# can be overridden with a DEADLINE_<ROUTE>_MS environment variable, e.g.
+# DEADLINE_GET_CHARACTER_MS=5000.
+DEFAULT_DEADLINE_MS = 2000
+ROUTE_DEADLINES_MS = {
+    "get_character": 3000,
+    "list_characters": 2000,
+    "get_movie": 2000,
+    "list_movies": 1000,
+    "get_line": 1000,
+    "get_lines": 2000,
+    "get_conversation": 1000,
+    "stream_conversation": 5000,
+    "add_conversation": 5000,
+}
+
+
+def deadline_ms(route):
+    default = ROUTE_DEADLINES_MS.get(route, DEFAULT_DEADLINE_MS)
+    return int(os.environ.get(f"DEADLINE_{route.upper()}_MS", default))
+
+
+class DeadlineExceeded(Exception):
+    """Raised when Postgres cancelled a statement that overran its route's deadline."""
+
+    def __init__(self, route, deadline_ms, elapsed_ms):
+        super().__init__(f"{route} exceeded its {deadline_ms}ms deadline")
+        self.route = route
+        self.deadline_ms = deadline_ms
+        self.elapsed_ms = elapsed_ms
+
+
+class RequestCancelled(Exception):
+    """Raised when a request's statement was cancelled because its client disconnected."""
+
+    def __init__(self, route):
+        super().__init__(f"{route} was cancelled, its client disconnected")
+        self.route = route
+
+
+class RequestScope:
+    """
+    The database connections currently used on behalf of one request, so
+    their queries can be cancelled when the client disconnects.
+
+    A scope is pinned when other requests are waiting on its result (see
+    src/singleflight.py), in which case a disconnect no longer cancels it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._connections = set()
+        self.pinned = False
+        self.disconnected = False
+
+    def register(self, dbapi_connection):
+        with self._lock:
+            self._connections.add(dbapi_connection)
+
+    def unregister(self, dbapi_connection):
+        with self._lock:
+            self._connections.discard(dbapi_connection)
+
+    def cancel(self):
+        with self._lock:
+            self.disconnected = True
+            if self.pinned:
+                return
+            for dbapi_connection in self._connections:
+                # psycopg2's cancel() is safe to call from another thread
+                # while a query is running on the connection.
+                dbapi_connection.cancel()
+
+
+current_scope = contextvars.ContextVar("current_scope", default=None)
+
+
+class CancelOnDisconnectMiddleware:
+    """
+    ASGI middleware cancelling the running queries of a request as soon as
+    its client disconnects, instead of letting them hold a connection until
+    they finish on their own.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_scope = RequestScope()
+        token = current_scope.set(request_scope)
+        messages = asyncio.Queue()
+
+        async def listen():
+            while True:
+                message = await receive()
+                await messages.put(message)
+                if message["type"] == "http.disconnect":
+                    request_scope.cancel()
+                    return
+
+        listener = asyncio.ensure_future(listen())
+        try:
+            await self.app(scope, messages.get, send)
+        finally:
+            listener.cancel()
+            current_scope.reset(token)
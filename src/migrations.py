@@ -0,0 +1,176 @@
+"""
+Versioned schema migrations. Each migration is a list of SQL statements to
+upgrade and the statements undoing them, applied in a transaction and
+recorded in the `schema_migrations` table.
+
+    python -m src.migrations status
+    python -m src.migrations upgrade [version]
+    python -m src.migrations downgrade <version>
+
+The indexes below are matched to the queries in src/api/. Each comment names
+the route the index serves. Indexes are created without CONCURRENTLY so they
+can run inside the migration's transaction, which blocks writes to the table
+while building. That is fine at this data size.
+"""
+import sys
+from dataclasses import dataclass
+from typing import List
+
+import sqlalchemy
+
+from src import database as db
+
+
+@dataclass
+class Migration:
+    version: int
+    description: str
+    upgrade: List[str]
+    downgrade: List[str]
+
+
+MIGRATIONS = [
+    Migration(
+        1,
+        "ordered conversation transcripts",
+        [
+            # get_conversation: lines of one conversation in line_sort order
+            "CREATE INDEX IF NOT EXISTS lines_conversation_id_line_sort_idx "
+            "ON lines (conversation_id, line_sort)",
+        ],
+        [
+            "DROP INDEX IF EXISTS lines_conversation_id_line_sort_idx",
+        ],
+    ),
+    Migration(
+        2,
+        "join and filter columns",
+        [
+            # list_characters, get_movie: count of lines per character
+            "CREATE INDEX IF NOT EXISTS lines_character_id_idx ON lines (character_id)",
+            # get_lines filtered by movie: lines of the movies whose title matches
+            "CREATE INDEX IF NOT EXISTS lines_movie_id_idx ON lines (movie_id)",
+            # get_character: both halves of the conversations union, index only
+            "CREATE INDEX IF NOT EXISTS conversations_character1_id_idx "
+            "ON conversations (character1_id) INCLUDE (conversation_id, character2_id)",
+            "CREATE INDEX IF NOT EXISTS conversations_character2_id_idx "
+            "ON conversations (character2_id) INCLUDE (conversation_id, character1_id)",
+            # get_movie top characters, add_conversation character validation
+            "CREATE INDEX IF NOT EXISTS characters_movie_id_character_id_idx "
+            "ON characters (movie_id, character_id)",
+        ],
+        [
+            "DROP INDEX IF EXISTS lines_character_id_idx",
+            "DROP INDEX IF EXISTS lines_movie_id_idx",
+            "DROP INDEX IF EXISTS conversations_character1_id_idx",
+            "DROP INDEX IF EXISTS conversations_character2_id_idx",
+            "DROP INDEX IF EXISTS characters_movie_id_character_id_idx",
+        ],
+    ),
+    Migration(
+        3,
+        "list endpoint sort orders",
+        [
+            # list_characters sort=character: ORDER BY name, character_id
+            "CREATE INDEX IF NOT EXISTS characters_name_character_id_idx "
+            "ON characters (name, character_id)",
+            # list_movies sort=movie_title / year / rating, movie_id tie break
+            "CREATE INDEX IF NOT EXISTS movies_title_movie_id_idx ON movies (title, movie_id)",
+            "CREATE INDEX IF NOT EXISTS movies_year_movie_id_idx ON movies (year, movie_id)",
+            "CREATE INDEX IF NOT EXISTS movies_imdb_rating_movie_id_idx "
+            "ON movies (imdb_rating DESC, movie_id)",
+        ],
+        [
+            "DROP INDEX IF EXISTS characters_name_character_id_idx",
+            "DROP INDEX IF EXISTS movies_title_movie_id_idx",
+            "DROP INDEX IF EXISTS movies_year_movie_id_idx",
+            "DROP INDEX IF EXISTS movies_imdb_rating_movie_id_idx",
+        ],
+    ),
+    Migration(
+        4,
+        "substring name and title filters",
+        [
+            # ilike '%name%' filters of list_characters, list_movies and get_lines
+            "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+            "CREATE INDEX IF NOT EXISTS characters_name_trgm_idx "
+            "ON characters USING gin (name gin_trgm_ops)",
+            "CREATE INDEX IF NOT EXISTS movies_title_trgm_idx "
+            "ON movies USING gin (title gin_trgm_ops)",
+        ],
+        [
+            "DROP INDEX IF EXISTS characters_name_trgm_idx",
+            "DROP INDEX IF EXISTS movies_title_trgm_idx",
+        ],
+    ),
+]
+
+HEAD = MIGRATIONS[-1].version
+
+
+def _ensure_version_table(conn):
+    conn.execute(sqlalchemy.text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version integer PRIMARY KEY, "
+        "description text NOT NULL, "
+        "applied_at timestamptz NOT NULL DEFAULT now())"
+    ))
+
+
+def current_version(conn):
+    _ensure_version_table(conn)
+    version = conn.execute(sqlalchemy.text("SELECT max(version) FROM schema_migrations")).scalar()
+    return version or 0
+
+
+def upgrade(target=HEAD, engine=None):
+    """Applies every migration after the current version up to `target`."""
+    engine = engine or db.engine
+    for migration in MIGRATIONS:
+        with engine.begin() as conn:
+            if not current_version(conn) < migration.version <= target:
+                continue
+            for statement in migration.upgrade:
+                conn.execute(sqlalchemy.text(statement))
+            conn.execute(
+                sqlalchemy.text("INSERT INTO schema_migrations (version, description) VALUES (:v, :d)"),
+                {"v": migration.version, "d": migration.description},
+            )
+            print(f"upgraded to {migration.version}: {migration.description}")
+
+
+def downgrade(target, engine=None):
+    """Undoes every applied migration after `target`, newest first."""
+    engine = engine or db.engine
+    for migration in reversed(MIGRATIONS):
+        with engine.begin() as conn:
+            if not target < migration.version <= current_version(conn):
+                continue
+            for statement in migration.downgrade:
+                conn.execute(sqlalchemy.text(statement))
+            conn.execute(
+                sqlalchemy.text("DELETE FROM schema_migrations WHERE version = :v"),
+                {"v": migration.version},
+            )
+            print(f"downgraded {migration.version}: {migration.description}")
+
+
+def main(argv):
+    command = argv[0] if argv else "status"
+    if command == "upgrade":
+        upgrade(int(argv[1]) if len(argv) > 1 else HEAD)
+    elif command == "downgrade" and len(argv) > 1:
+        downgrade(int(argv[1]))
+    elif command == "status":
+        with db.engine.begin() as conn:
+            version = current_version(conn)
+        for migration in MIGRATIONS:
+            mark = "x" if migration.version <= version else " "
+            print(f"[{mark}] {migration.version}: {migration.description}")
+    else:
+        print(__doc__)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
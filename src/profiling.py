@@ -0,0 +1,293 @@
+import asyncio
+import collections
+import cProfile
+import functools
+import io
+import itertools
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+# Time between two stack samples of a profiled request, in milliseconds.
+DEFAULT_SAMPLE_INTERVAL_MS = 5
+# Sessions and snapshots older than the most recent ones are dropped to
+# bound memory.
+MAX_SESSIONS = 16
+MAX_SNAPSHOTS = 8
+
+
+def frame_label(code):
+    """`function (dir/file.py:line)`, the frame name used in folded stacks."""
+    path = code.co_filename
+    short = os.path.join(os.path.basename(os.path.dirname(path)), os.path.basename(path))
+    return f"{code.co_name} ({short}:{code.co_firstlineno})"
+
+
+def fold(frame):
+    """Folds a stack into the `root;...;leaf` form flamegraph tools read."""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class ProfileSession:
+    """
+    Profiles the next `requests` calls of one route, either by sampling the
+    stack of the thread running each call (`sample`) or with cProfile
+    (`cprofile`). Sampled stacks are folded, ready for flamegraph.pl or
+    speedscope.
+    """
+
+    def __init__(self, id, route, requests, mode, interval_ms):
+        self.id = id
+        self.route = route
+        self.requests = requests
+        self.mode = mode
+        self.interval = interval_ms / 1000
+        self._lock = threading.Lock()
+        self._started = 0
+        self.completed = 0
+        self.total_ms = 0.0
+        self.stacks = collections.Counter()
+        self.stats = None
+
+    @property
+    def done(self):
+        return self.completed >= self.requests
+
+    def claim(self):
+        """
+        Reserves one of the remaining requests, returning how many are left
+        after it, or None once all are taken.
+        """
+        with self._lock:
+            if self._started >= self.requests:
+                return None
+            self._started += 1
+            return self.requests - self._started
+
+    def _sample(self, ident, stop):
+        stacks = collections.Counter()
+        while not stop.wait(self.interval):
+            frame = sys._current_frames().get(ident)
+            if frame is not None:
+                stacks[fold(frame)] += 1
+        return stacks
+
+    def run(self, fn, args, kwargs):
+        start = time.perf_counter()
+        if self.mode == "cprofile":
+            profile = cProfile.Profile()
+            try:
+                return profile.runcall(fn, *args, **kwargs)
+            finally:
+                self.finish(start, profile=profile)
+
+        stop = threading.Event()
+        samples = {}
+        ident = threading.get_ident()
+        sampler = threading.Thread(
+            target=lambda: samples.update(stacks=self._sample(ident, stop)),
+            name=f"profile-{self.id}",
+            daemon=True,
+        )
+        sampler.start()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            stop.set()
+            sampler.join()
+            self.finish(start, stacks=samples.get("stacks"))
+
+    def finish(self, start, profile=None, stacks=None):
+        with self._lock:
+            self.completed += 1
+            self.total_ms += (time.perf_counter() - start) * 1000
+            if stacks:
+                self.stacks.update(stacks)
+            if profile is not None:
+                if self.stats is None:
+                    self.stats = pstats.Stats(profile)
+                else:
+                    self.stats.add(profile)
+
+    def folded(self):
+        with self._lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def report(self, top=30):
+        with self._lock:
+            report = {
+                "id": self.id,
+                "route": self.route,
+                "mode": self.mode,
+                "requests": self.requests,
+                "completed": self.completed,
+                "mean_ms": self.total_ms / self.completed if self.completed else None,
+            }
+            if self.mode == "cprofile":
+                out = io.StringIO()
+                if self.stats is not None:
+                    self.stats.stream = out
+                    self.stats.sort_stats("cumulative").print_stats(top)
+                report["stats"] = out.getvalue()
+            else:
+                report["samples"] = sum(self.stacks.values())
+            return report
+
+
+class Profiler:
+    """
+    Arms profiling sessions on routes of a running app without redeploying.
+
+    Arming a route swaps its endpoint for a wrapper that profiles the next
+    calls inside the thread actually running them, so sync handlers in the
+    threadpool are covered. The original endpoint is put back as soon as the
+    session has claimed all of its requests.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._sessions = collections.OrderedDict()
+        # route name -> ([(route, original endpoint)], session) while a session is armed
+        self._armed = {}
+
+    def arm(self, routes, name, requests, mode="sample", interval_ms=DEFAULT_SAMPLE_INTERVAL_MS):
+        # a route registered under several paths is profiled on all of them
+        routes = [r for r in routes if getattr(r, "name", None) == name and hasattr(r, "dependant")]
+        if not routes:
+            raise KeyError(name)
+
+        with self._lock:
+            if name in self._armed:
+                raise ValueError(f"{name} is already being profiled")
+            session = ProfileSession(next(self._ids), name, requests, mode, interval_ms)
+            self._sessions[session.id] = session
+            while len(self._sessions) > MAX_SESSIONS:
+                self._sessions.popitem(last=False)
+            originals = [(route, route.dependant.call) for route in routes]
+            self._armed[name] = (originals, session)
+            for route, original in originals:
+                route.dependant.call = self._wrap(session, original)
+        return session
+
+    def _disarm(self, session):
+        with self._lock:
+            armed = self._armed.get(session.route)
+            if armed is not None and armed[1] is session:
+                originals, _ = self._armed.pop(session.route)
+                for route, original in originals:
+                    route.dependant.call = original
+
+    def _wrap(self, session, fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                left = session.claim()
+                if left is None:
+                    return await fn(*args, **kwargs)
+                if left == 0:
+                    self._disarm(session)
+                profile = cProfile.Profile()
+                start = time.perf_counter()
+                profile.enable()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    profile.disable()
+                    session.finish(start, profile=profile)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            left = session.claim()
+            if left is None:
+                return fn(*args, **kwargs)
+            if left == 0:
+                self._disarm(session)
+            return session.run(fn, args, kwargs)
+
+        return wrapper
+
+    def cancel(self, id):
+        session = self._sessions.get(id)
+        if session is not None:
+            self._disarm(session)
+        return session
+
+    def session(self, id):
+        return self._sessions.get(id)
+
+    def sessions(self):
+        return [session.report() for session in self._sessions.values()]
+
+
+profiler = Profiler()
+
+
+class MemoryTracker:
+    """tracemalloc snapshots of the process, numbered so they can be diffed."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._snapshots = collections.OrderedDict()
+
+    def start(self, frames):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    def stop(self):
+        tracemalloc.stop()
+        with self._lock:
+            self._snapshots.clear()
+
+    def snapshot(self):
+        """Takes a snapshot, raising RuntimeError if tracing is not started."""
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ])
+        with self._lock:
+            id = next(self._ids)
+            self._snapshots[id] = snapshot
+            while len(self._snapshots) > MAX_SNAPSHOTS:
+                self._snapshots.popitem(last=False)
+        return id, snapshot
+
+    def get(self, id):
+        with self._lock:
+            return self._snapshots.get(id)
+
+    def state(self):
+        current, peak = tracemalloc.get_traced_memory()
+        with self._lock:
+            return {
+                "tracing": tracemalloc.is_tracing(),
+                "traced_bytes": current,
+                "peak_bytes": peak,
+                "snapshots": list(self._snapshots),
+            }
+
+
+memory = MemoryTracker()
+
+
+def format_stats(stats, top):
+    return [
+        {
+            "location": str(stat.traceback[0]) if stat.traceback else None,
+            "size_bytes": stat.size,
+            "count": stat.count,
+            **({"size_diff_bytes": stat.size_diff, "count_diff": stat.count_diff}
+               if isinstance(stat, tracemalloc.StatisticDiff) else {}),
+        }
+        for stat in stats[:top]
+    ]
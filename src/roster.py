@@ -0,0 +1,95 @@
+import threading
+
+import sqlalchemy
+
+from src import database as db
+
+# Characters of one movie among the bound `character_ids`. An index only scan
+# of characters_movie_id_character_id_idx (see src/migrations.py).
+members_stmt = (
+    sqlalchemy.select(db.characters.c.character_id)
+    .where(
+        sqlalchemy.and_(
+            db.characters.c.movie_id == sqlalchemy.bindparam("movie_id"),
+            db.characters.c.character_id.in_(sqlalchemy.bindparam("character_ids", expanding=True)),
+        )
+    )
+)
+
+
+class MovieRoster:
+    """
+    Cached `movie_id -> set(character_id)` map, so checking that characters
+    belong to a movie is a set lookup instead of a query.
+
+    The map is loaded with a single query on first use. A lookup missing
+    from it is re-checked against the database before being rejected, which
+    also picks up characters added since the load. Anything that changes or
+    removes characters must call `invalidate`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._movies = {}
+        # movies invalidated since the load, reloaded on their next lookup
+        self._stale = set()
+
+    def _load(self):
+        movies = {}
+        with db.engine.connect() as conn:
+            result = conn.execute(
+                sqlalchemy.select(db.characters.c.movie_id, db.characters.c.character_id)
+            )
+            for row in result:
+                movies.setdefault(row.movie_id, set()).add(row.character_id)
+        self._movies = movies
+        self._stale = set()
+        self._loaded = True
+
+    def _reload(self, movie_id):
+        with db.engine.connect() as conn:
+            result = conn.execute(
+                sqlalchemy.select(db.characters.c.character_id)
+                .where(db.characters.c.movie_id == movie_id)
+            )
+            self._movies[movie_id] = set(result.scalars())
+        self._stale.discard(movie_id)
+
+    def _characters(self, movie_id):
+        if not self._loaded:
+            self._load()
+        elif movie_id in self._stale:
+            self._reload(movie_id)
+        return self._movies.get(movie_id, ())
+
+    def missing(self, conn, movie_id, character_ids):
+        """
+        Returns the subset of `character_ids` that are not characters of
+        `movie_id`, only querying through `conn` when the map lacks some.
+        """
+        with self._lock:
+            characters = self._characters(movie_id)
+            missing = {id for id in character_ids if id not in characters}
+        if not missing:
+            return missing
+
+        found = set(conn.execute(
+            members_stmt, {"movie_id": movie_id, "character_ids": list(missing)}
+        ).scalars())
+        if found:
+            with self._lock:
+                self._movies.setdefault(movie_id, set()).update(found)
+        return missing - found
+
+    def invalidate(self, movie_id=None):
+        """Drops `movie_id`, or the whole map, so it is reloaded on next use."""
+        with self._lock:
+            if movie_id is None:
+                self._loaded = False
+                self._movies = {}
+            elif self._loaded:
+                self._stale.add(movie_id)
+
+
+roster = MovieRoster()
@@ -0,0 +1,317 @@
+import logging
+import math
+import re
+import threading
+import zlib
+from collections import Counter
+
+import numpy as np
+import sqlalchemy
+
+from src import database as db
+
+TOKEN_RE = re.compile(r"[a-z']+")
+
+# Terms are hashed into a fixed number of buckets, which keeps the matrix
+# dense and small (characters x FEATURES float32) without a vocabulary.
+FEATURES = 1024
+
+# Number of neighbours precomputed per character.
+TOP_K = 10
+
+# Rows multiplied against the whole matrix at once while computing neighbours.
+BATCH_SIZE = 512
+
+# Seconds a lookup waits for the index to finish building before giving up.
+BUILD_WAIT = 2.0
+
+logger = logging.getLogger(__name__)
+
+
+class IndexNotReady(Exception):
+    """Raised by lookups while the index is still being built."""
+
+
+def term_counts(text):
+    return Counter(zlib.crc32(token.encode()) % FEATURES for token in TOKEN_RE.findall(text.lower()))
+
+
+class SimilarityIndex:
+    """
+    Nearest neighbour index of characters by how they talk.
+
+    Each character is a TF-IDF vector over the hashed terms of all of their
+    lines, L2 normalized so a dot product is the cosine similarity. The top
+    `TOP_K` neighbours of every character are computed when the index is built
+    with batched matrix products, so a lookup is a dictionary access.
+
+    The index is built in a background thread, started with the app (see
+    src/api/server.py), and swapped in once complete, so lookups never wait
+    on the scan of `lines`. Document frequencies are fixed at build time.
+    `refresh` queues characters that gained lines for the same thread, which
+    recomputes their vectors and the neighbour lists they can affect on
+    copies of the matrices and swaps those in, so neither lookups nor the
+    writes calling it wait on the recompute.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built = False
+        # whether the background thread is running
+        self._working = False
+        self._ready = threading.Event()
+        self._idle = threading.Event()
+        self._idle.set()
+        # characters waiting to be refreshed by the background thread
+        self._pending = set()
+        # character_id -> row in the matrices below
+        self._rows = {}
+        self._character_ids = []
+        # character_id -> (name, movie title)
+        self._names = {}
+        self._counts = []
+        self._idf = None
+        self._vectors = None
+        self._neighbours = None
+        self._scores = None
+
+    @staticmethod
+    def _vector(counts, idf):
+        vector = np.zeros(FEATURES, dtype=np.float32)
+        for feature, count in counts.items():
+            vector[feature] = (1 + math.log(count)) * idf[feature]
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector
+
+    def _fetch_counts(self, conn, character_ids=None):
+        stmt = sqlalchemy.select(db.lines.c.character_id, db.lines.c.line_text)
+        if character_ids is not None:
+            stmt = stmt.where(db.lines.c.character_id.in_(character_ids))
+
+        counts = {}
+        for row in conn.execution_options(yield_per=5000).execute(stmt):
+            if row.line_text is None:
+                continue
+            counts.setdefault(row.character_id, Counter()).update(term_counts(row.line_text))
+        return counts
+
+    def _fetch_names(self, conn, character_ids=None):
+        stmt = sqlalchemy.select(
+            db.characters.c.character_id,
+            db.characters.c.name,
+            db.movies.c.title,
+        ).select_from(db.characters.join(db.movies))
+        if character_ids is not None:
+            stmt = stmt.where(db.characters.c.character_id.in_(character_ids))
+        return {row.character_id: (row.name, row.title) for row in conn.execute(stmt)}
+
+    @staticmethod
+    def _compute_neighbours(vectors, neighbours, scores, rows):
+        """Recompute the neighbour lists of `rows` against every character."""
+        k = min(TOP_K, len(vectors) - 1)
+        for start in range(0, len(rows), BATCH_SIZE):
+            batch = rows[start:start + BATCH_SIZE]
+            batch_scores = vectors[batch] @ vectors.T
+            batch_scores[np.arange(len(batch)), batch] = -np.inf
+            if k <= 0:
+                continue
+            top = np.argpartition(-batch_scores, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(batch_scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            neighbours[batch, :k] = np.take_along_axis(top, order, axis=1)
+            scores[batch, :k] = np.take_along_axis(top_scores, order, axis=1)
+
+    def _build(self):
+        with db.engine.connect() as conn:
+            counts = self._fetch_counts(conn)
+            names = self._fetch_names(conn)
+
+        character_ids = [c for c in counts if c in names]
+        document_frequency = np.zeros(FEATURES, dtype=np.float32)
+        for character_id in character_ids:
+            document_frequency[list(counts[character_id])] += 1
+        n = len(character_ids)
+        idf = np.log((1 + n) / (1 + document_frequency)) + 1
+
+        character_counts = [counts[c] for c in character_ids]
+        vectors = np.zeros((n, FEATURES), dtype=np.float32)
+        for i, c in enumerate(character_counts):
+            vectors[i] = self._vector(c, idf)
+
+        neighbours = np.full((n, TOP_K), -1, dtype=np.int32)
+        scores = np.zeros((n, TOP_K), dtype=np.float32)
+        self._compute_neighbours(vectors, neighbours, scores, np.arange(n))
+
+        with self._lock:
+            self._idf = idf
+            self._character_ids = character_ids
+            self._rows = {c: i for i, c in enumerate(character_ids)}
+            self._names = names
+            self._counts = character_counts
+            self._vectors = vectors
+            self._neighbours = neighbours
+            self._scores = scores
+            self._built = True
+        self._ready.set()
+
+    def _apply(self, character_ids):
+        """
+        Recompute the vectors of `character_ids` from the database and every
+        neighbour list they are, or now should be, part of. Only this thread
+        replaces the matrices, so they are read without the lock and the
+        lock is only taken to swap in the updated copies.
+        """
+        with self._lock:
+            if not self._built:
+                return
+        new_ids = [c for c in character_ids if c not in self._rows]
+
+        with db.engine.connect() as conn:
+            counts = self._fetch_counts(conn, character_ids)
+            names = {**self._names, **(self._fetch_names(conn, new_ids) if new_ids else {})}
+
+        rows = dict(self._rows)
+        all_ids = list(self._character_ids)
+        all_counts = list(self._counts)
+        new_ids = [c for c in new_ids if c in counts and c in names]
+        for character_id in new_ids:
+            rows[character_id] = len(all_ids)
+            all_ids.append(character_id)
+            all_counts.append(Counter())
+        grow = len(new_ids)
+        vectors = np.vstack([self._vectors, np.zeros((grow, FEATURES), dtype=np.float32)])
+        neighbours = np.vstack([self._neighbours, np.full((grow, TOP_K), -1, dtype=np.int32)])
+        scores = np.vstack([self._scores, np.zeros((grow, TOP_K), dtype=np.float32)])
+
+        updated = []
+        for character_id in character_ids:
+            row = rows.get(character_id)
+            if row is None or character_id not in counts:
+                continue
+            all_counts[row] = counts[character_id]
+            vectors[row] = self._vector(all_counts[row], self._idf)
+            updated.append(row)
+        if not updated:
+            return
+
+        # Other characters are affected when an updated character is
+        # already one of their neighbours or now beats their last one.
+        updated_scores = vectors @ vectors[updated].T
+        updated_scores[updated, np.arange(len(updated))] = -np.inf
+        affected = np.isin(neighbours, updated).any(axis=1)
+        affected |= (updated_scores > scores[:, -1:]).any(axis=1)
+        affected |= (neighbours[:, -1] == -1)
+        affected[updated] = True
+        self._compute_neighbours(vectors, neighbours, scores, np.flatnonzero(affected))
+
+        with self._lock:
+            if not self._built:
+                # invalidated meanwhile, the rebuild picks the lines up
+                return
+            self._rows = rows
+            self._character_ids = all_ids
+            self._names = names
+            self._counts = all_counts
+            self._vectors = vectors
+            self._neighbours = neighbours
+            self._scores = scores
+
+    def _work(self):
+        while True:
+            with self._lock:
+                build = not self._built
+                if build:
+                    # the build reads every line committed so far
+                    self._pending = set()
+                elif not self._pending:
+                    self._working = False
+                    self._idle.set()
+                    return
+                pending, self._pending = self._pending, set()
+
+            try:
+                if build:
+                    self._build()
+                else:
+                    self._apply(list(pending))
+            except Exception:
+                logger.exception("updating the similarity index failed")
+                with self._lock:
+                    # a failed refresh is retried with the next one
+                    self._pending.update(pending)
+                    self._working = False
+                    self._idle.set()
+                return
+
+    def _start(self):
+        # called with the lock held
+        if not self._working:
+            self._working = True
+            self._idle.clear()
+            threading.Thread(target=self._work, name="similarity-build", daemon=True).start()
+
+    def start_build(self):
+        """Builds the index in a background thread unless built or building."""
+        with self._lock:
+            if not self._built:
+                self._start()
+
+    def wait_ready(self, timeout=None):
+        """Waits for the index to be built, returning whether it is."""
+        return self._ready.wait(timeout)
+
+    def wait_idle(self, timeout=None):
+        """Waits for the queued refreshes to be applied, returning whether they are."""
+        return self._idle.wait(timeout)
+
+    def invalidate(self):
+        """Drop the index and rebuild it in the background."""
+        with self._lock:
+            self._built = False
+            self._ready.clear()
+            self._start()
+
+    def refresh(self, character_ids):
+        """
+        Queues `character_ids`, which gained lines, for the background
+        thread and returns at once. Lines committed before the index is
+        built are picked up by the build instead.
+        """
+        with self._lock:
+            if not self._built and not self._working:
+                return
+            self._pending.update(character_ids)
+            self._start()
+
+    def similar(self, character_id, limit=TOP_K):
+        """
+        Returns the `limit` characters that talk most like `character_id`, or
+        None when the character has no lines. Raises IndexNotReady when the
+        index is not built within BUILD_WAIT seconds.
+        """
+        self.start_build()
+        if not self.wait_ready(BUILD_WAIT):
+            raise IndexNotReady()
+        with self._lock:
+            row = self._rows.get(character_id)
+            if row is None:
+                return None
+
+            result = []
+            for neighbour, score in zip(self._neighbours[row, :limit], self._scores[row, :limit]):
+                if neighbour < 0:
+                    break
+                neighbour_id = self._character_ids[neighbour]
+                name, title = self._names[neighbour_id]
+                result.append({
+                    "character_id": neighbour_id,
+                    "character": name,
+                    "movie": title,
+                    "similarity": round(float(score), 4),
+                })
+            return result
+
+
+similarity_index = SimilarityIndex()
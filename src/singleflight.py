@@ -0,0 +1,131 @@
+import contextvars
+import functools
+import threading
+
+from src import deadlines
+
+# The (method, path, query string) of the request being served, set by
+# AdmissionMiddleware so a running call can be found before routing.
+current_target = contextvars.ContextVar("current_target", default=None)
+# The call the request joined before admission, see SingleFlight.join.
+current_join = contextvars.ContextVar("current_join", default=None)
+
+
+class _Call:
+    def __init__(self, key):
+        self.key = key
+        # the leader's request, its queries must outlive a disconnect once
+        # other requests wait on them
+        self.scope = deadlines.current_scope.get()
+        self.target = current_target.get()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with identical arguments into one execution.
+
+    The first caller for a key runs the function, every caller that arrives
+    while it is still running waits for it and receives the same result (or
+    the same exception). Nothing is cached once the call finishes, so the
+    next request after that hits the database again.
+
+    A leader cancelled because its own client disconnected says nothing
+    about the requests waiting on it, so they run the call again instead.
+
+    Running calls are also indexed by the request target of their leader,
+    so an identical request can `join` one before it is admitted and wait
+    for its result without taking an admission slot.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._targets = {}
+        self._executed = 0
+        self._coalesced = 0
+
+    def join(self, target):
+        """
+        Records that the current request serves `target` and joins the
+        running call whose leader serves the same, returning False when there
+        is none. The request then receives that call's result from `do` even
+        if the call finishes before the request gets there.
+        """
+        current_target.set(target)
+        with self._lock:
+            call = self._targets.get(target)
+            if call is None:
+                return False
+            self._coalesced += 1
+            if call.scope is not None:
+                call.scope.pinned = True
+        current_join.set(call)
+        return True
+
+    def do(self, key, fn, *args, **kwargs):
+        call = current_join.get()
+        if call is not None and call.key == key:
+            # joined before admission, the call may have finished since
+            current_join.set(None)
+        else:
+            call = None
+
+        while True:
+            if call is None:
+                with self._lock:
+                    call = self._calls.get(key)
+                    if call is None:
+                        call = _Call(key)
+                        self._calls[key] = call
+                        if call.target is not None:
+                            self._targets.setdefault(call.target, call)
+                        self._executed += 1
+                        break
+                    self._coalesced += 1
+                    if call.scope is not None:
+                        call.scope.pinned = True
+
+            call.done.wait()
+            if isinstance(call.error, deadlines.RequestCancelled):
+                call = None
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                if self._targets.get(call.target) is call:
+                    del self._targets[call.target]
+            call.done.set()
+        return call.result
+
+    def coalesce(self, fn):
+        """Decorator coalescing calls to `fn` keyed on its arguments."""
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = (fn.__module__, fn.__qualname__, args, tuple(sorted(kwargs.items())))
+            return self.do(key, fn, *args, **kwargs)
+
+        return wrapper
+
+    def stats(self):
+        with self._lock:
+            return {
+                "executed": self._executed,
+                "coalesced": self._coalesced,
+                "in_flight": len(self._calls),
+            }
+
+
+flight = SingleFlight()
@@ -0,0 +1,324 @@
+"""
+Read-only binary snapshot of the corpus shared between worker processes.
+
+The file is a magic number, the length of a JSON header and the header
+itself, followed by the raw bytes of every array aligned to 8 bytes. The
+header maps each array name to its dtype, shape and offset. Workers mmap the
+file and wrap the arrays with np.frombuffer, so every process shares the same
+pages of the OS page cache instead of holding its own copy.
+
+Strings are stored as a uint8 blob plus int64 offsets and a null mask.
+
+Writes schedule a rebuild with `request_rebuild`. The worker that handled
+the write rebuilds and swaps the file in the background, at most once per
+REBUILD_DELAY seconds, and every worker picks the new file up within
+RELOAD_INTERVAL (see `start_watching`).
+
+Only get_movie is served from the snapshot. The other in-memory read models
+(READ_MODELS) are built by every worker from the database, and a worker only
+applies the writes it handles to its own. So every worker drops them when it
+picks up a swapped snapshot, and they are rebuilt with the writes of every
+worker.
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+import sqlalchemy
+
+from src import database as db
+from src.autocomplete import prefix_index
+from src.counts import totals
+from src.cube import cube
+from src.similarity import similarity_index
+
+# Set by serve.py for every worker. Without it the routers query the database.
+SNAPSHOT_ENV = "MOVIE_API_SNAPSHOT"
+
+MAGIC = b"MOVSNAP1"
+ALIGNMENT = 8
+
+# How often a worker checks whether the snapshot file has been swapped.
+RELOAD_INTERVAL = 1.0
+
+# Seconds a rebuild waits after a write, so a burst of writes is picked up
+# by a single rebuild.
+REBUILD_DELAY = 1.0
+
+logger = logging.getLogger(__name__)
+
+# Read models a worker drops when a write swaps the snapshot.
+READ_MODELS = (cube, totals, prefix_index, similarity_index)
+
+
+def _string_arrays(name, values):
+    encoded = [b"" if v is None else str(v).encode() for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(e) for e in encoded])
+    return {
+        f"{name}.data": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        f"{name}.offsets": offsets,
+        f"{name}.null": np.array([v is None for v in values], dtype=np.bool_),
+    }
+
+
+def _collect():
+    movies_stmt = sqlalchemy.select(
+        db.movies.c.movie_id,
+        db.movies.c.title,
+    ).order_by(db.movies.c.movie_id)
+
+    line_counts = (
+        sqlalchemy.select(
+            db.lines.c.character_id,
+            sqlalchemy.func.count(db.lines.c.line_id).label("number_of_lines"),
+        )
+        .group_by(db.lines.c.character_id)
+        .subquery()
+    )
+    characters_stmt = (
+        sqlalchemy.select(
+            db.characters.c.character_id,
+            db.characters.c.name,
+            db.characters.c.movie_id,
+            sqlalchemy.func.coalesce(line_counts.c.number_of_lines, 0).label("number_of_lines"),
+        )
+        .select_from(db.characters.outerjoin(line_counts))
+        .order_by(db.characters.c.character_id)
+    )
+
+    with db.engine.connect() as conn:
+        movies = conn.execute(movies_stmt).fetchall()
+        characters = conn.execute(characters_stmt).fetchall()
+
+    arrays = {
+        "movies.movie_id": np.array([m.movie_id for m in movies], dtype=np.int64),
+        "characters.character_id": np.array([c.character_id for c in characters], dtype=np.int64),
+        "characters.number_of_lines": np.array([c.number_of_lines for c in characters], dtype=np.int64),
+    }
+    arrays.update(_string_arrays("movies.title", [m.title for m in movies]))
+    arrays.update(_string_arrays("characters.name", [c.name for c in characters]))
+
+    # Aggregate for get_movie: rows of the characters with lines, grouped by
+    # movie row and ordered by number of lines, highest to lowest.
+    movie_ids = arrays["movies.movie_id"]
+    character_movie_ids = np.array([c.movie_id for c in characters], dtype=np.int64)
+    movie_rows = np.searchsorted(movie_ids, character_movie_ids)
+    known = movie_rows < len(movie_ids)
+    known[known] = movie_ids[movie_rows[known]] == character_movie_ids[known]
+    speaking = np.flatnonzero(known & (arrays["characters.number_of_lines"] > 0))
+    order = np.lexsort((
+        arrays["characters.character_id"][speaking],
+        -arrays["characters.number_of_lines"][speaking],
+        movie_rows[speaking],
+    ))
+    top_rows = speaking[order]
+    arrays["movies.top_characters"] = top_rows.astype(np.int64)
+    arrays["movies.top_characters_offsets"] = np.searchsorted(
+        movie_rows[top_rows], np.arange(len(movies) + 1)
+    ).astype(np.int64)
+
+    return arrays
+
+
+def write_snapshot(path):
+    """
+    Builds a snapshot from the database and atomically replaces `path` with
+    it, so workers never see a partially written file.
+    """
+    global _checked_at
+    arrays = _collect()
+
+    header = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = -(-offset // ALIGNMENT) * ALIGNMENT
+        header[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += array.nbytes
+    header_bytes = json.dumps(header).encode()
+    data_start = -(-(len(MAGIC) + 8 + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(data_start + header[name]["offset"])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+    # let this process see the new file on its next lookup
+    _checked_at = 0.0
+
+
+class Snapshot:
+    """A memory-mapped snapshot file. All arrays are read-only views of the mapping."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.inode = os.fstat(f.fileno()).st_ino
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a movie api snapshot")
+        (header_length,) = struct.unpack_from("<Q", self._mmap, len(MAGIC))
+        header_end = len(MAGIC) + 8 + header_length
+        header = json.loads(self._mmap[len(MAGIC) + 8:header_end])
+        data_start = -(-header_end // ALIGNMENT) * ALIGNMENT
+
+        self.arrays = {}
+        for name, spec in header.items():
+            dtype = np.dtype(spec["dtype"])
+            count = int(np.prod(spec["shape"]))
+            self.arrays[name] = np.frombuffer(
+                self._mmap, dtype=dtype, count=count, offset=data_start + spec["offset"]
+            ).reshape(spec["shape"])
+
+    def string(self, name, row):
+        if self.arrays[f"{name}.null"][row]:
+            return None
+        offsets = self.arrays[f"{name}.offsets"]
+        return bytes(self.arrays[f"{name}.data"][offsets[row]:offsets[row + 1]]).decode()
+
+    def _find(self, ids, value):
+        row = int(np.searchsorted(ids, value))
+        if row < len(ids) and ids[row] == value:
+            return row
+        return None
+
+    def movie_row(self, movie_id):
+        return self._find(self.arrays["movies.movie_id"], movie_id)
+
+    def get_movie(self, movie_id, top=5):
+        """Same result as the get_movie route, or None if the movie does not exist."""
+        row = self.movie_row(movie_id)
+        if row is None:
+            return None
+
+        offsets = self.arrays["movies.top_characters_offsets"]
+        top_rows = self.arrays["movies.top_characters"][offsets[row]:min(offsets[row + 1], offsets[row] + top)]
+        return {
+            "movie_id": int(self.arrays["movies.movie_id"][row]),
+            "title": self.string("movies.title", row),
+            "top_characters": [
+                {
+                    "character_id": int(self.arrays["characters.character_id"][c]),
+                    "character": self.string("characters.name", c),
+                    "num_lines": int(self.arrays["characters.number_of_lines"][c]),
+                }
+                for c in top_rows
+            ],
+        }
+
+
+_lock = threading.Lock()
+_current = None
+_checked_at = 0.0
+
+
+def current():
+    """
+    Returns the snapshot named by the MOVIE_API_SNAPSHOT environment variable,
+    reopening it when the file has been swapped, or None when not configured.
+    READ_MODELS are dropped whenever it has been swapped.
+    """
+    global _current, _checked_at
+
+    path = os.environ.get(SNAPSHOT_ENV)
+    if not path:
+        return None
+
+    now = time.monotonic()
+    if _current is not None and now - _checked_at < RELOAD_INTERVAL:
+        return _current
+
+    with _lock:
+        _checked_at = now
+        try:
+            inode = os.stat(path).st_ino
+        except FileNotFoundError:
+            return _current
+        if _current is None or _current.inode != inode:
+            # Dropped for this process's own rebuilds too, another worker's
+            # file may have been swapped in and out since the last check.
+            if _current is not None:
+                for read_model in READ_MODELS:
+                    read_model.invalidate()
+            _current = Snapshot(path)
+        return _current
+
+
+_watcher = None
+
+
+def _watch_loop():
+    while True:
+        time.sleep(RELOAD_INTERVAL)
+        try:
+            current()
+        except Exception:
+            logger.exception("reloading the snapshot failed")
+
+
+def start_watching():
+    """
+    Opens the snapshot, then checks for a swapped one every RELOAD_INTERVAL
+    in a background thread, so a worker drops its stale read models even
+    when it serves no get_movie request. Does nothing when no snapshot is
+    configured.
+    """
+    global _watcher
+    if not os.environ.get(SNAPSHOT_ENV):
+        return
+
+    # opened before the read models are built, so no swap goes unnoticed
+    current()
+
+    with _lock:
+        if _watcher is None:
+            _watcher = threading.Thread(target=_watch_loop, name="snapshot-watch", daemon=True)
+            _watcher.start()
+
+
+_rebuild_requested = threading.Event()
+_rebuilder = None
+
+
+def _rebuild_loop():
+    while True:
+        _rebuild_requested.wait()
+        time.sleep(REBUILD_DELAY)
+        # cleared before reading the database, so a write landing during the
+        # rebuild schedules another one
+        _rebuild_requested.clear()
+        path = os.environ.get(SNAPSHOT_ENV)
+        if not path:
+            continue
+        try:
+            write_snapshot(path)
+        except Exception:
+            logger.exception("rebuilding the snapshot failed")
+
+
+def request_rebuild():
+    """
+    Schedules a rebuild of the configured snapshot after a write. Does
+    nothing when no snapshot is configured.
+    """
+    global _rebuilder
+    if not os.environ.get(SNAPSHOT_ENV):
+        return
+
+    _rebuild_requested.set()
+    with _lock:
+        if _rebuilder is None:
+            _rebuilder = threading.Thread(target=_rebuild_loop, name="snapshot-rebuild", daemon=True)
+            _rebuilder.start()
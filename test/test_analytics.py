@@ -0,0 +1,48 @@
+from fastapi.testclient import TestClient
+
+from src.api.server import app
+from src.cube import cube
+
+client = TestClient(app)
+
+
+def test_analytics_total():
+    response = client.get("/analytics/")
+    assert response.status_code == 200
+
+    result = response.json()
+    assert len(result) == 1
+    assert result[0]["number_of_lines"] > 0
+
+
+def test_analytics_group_by_matches_total():
+    total = client.get("/analytics/").json()[0]["number_of_lines"]
+
+    response = client.get("/analytics/?group_by=gender&group_by=rating")
+    assert response.status_code == 200
+
+    result = response.json()
+    assert sum(row["number_of_lines"] for row in result) == total
+    assert all(set(row) == {"gender", "rating", "number_of_lines", "number_of_characters"} for row in result)
+
+
+def test_analytics_filter():
+    response = client.get("/analytics/?group_by=gender&rating=8")
+    assert response.status_code == 200
+
+    by_gender = client.get("/analytics/?group_by=rating&group_by=gender").json()
+    expected = sum(row["number_of_lines"] for row in by_gender if row["rating"] == 8)
+    assert sum(row["number_of_lines"] for row in response.json()) == expected
+
+
+def test_analytics_invalid_dimension():
+    response = client.get("/analytics/?group_by=title")
+    assert response.status_code == 422
+
+
+def test_analytics_skips_lines_already_built():
+    total = client.get("/analytics/").json()[0]["number_of_lines"]
+
+    # a line committed before the build is already counted by it
+    cube.record_lines([(cube._last_line_id, 0)])
+    assert client.get("/analytics/").json()[0]["number_of_lines"] == total
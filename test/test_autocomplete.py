@@ -0,0 +1,35 @@
+from fastapi.testclient import TestClient
+
+from src.api.server import app
+
+client = TestClient(app)
+
+
+def test_autocomplete_word_prefix():
+    response = client.get("/autocomplete?q=mat&kind=movie")
+    assert response.status_code == 200
+
+    titles = [movie["label"] for movie in response.json()]
+    assert "the matrix" in titles
+
+
+def test_autocomplete_ranked_by_popularity():
+    response = client.get("/autocomplete/?q=b&limit=20")
+    assert response.status_code == 200
+
+    result = response.json()
+    assert len(result) == 20
+    assert all(any(word.startswith("b") for word in item["label"].lower().split()) for item in result)
+    ranks = [item["rank"] for item in result]
+    assert ranks == sorted(ranks, reverse=True)
+    # popularity is compared within each kind, so neither kind crowds out the other
+    assert {item["kind"] for item in result} == {"movie", "character"}
+
+
+def test_autocomplete_characters():
+    response = client.get("/autocomplete/?q=bianca&kind=character")
+    assert response.status_code == 200
+
+    result = response.json()
+    assert result[0]["label"] == "BIANCA"
+    assert all(item["kind"] == "character" for item in result)
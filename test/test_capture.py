@@ -0,0 +1,46 @@
+import json
+
+from fastapi.testclient import TestClient
+
+from benchmarks import replay
+from src import capture
+from src.api.server import app
+
+
+def test_capture_record(tmp_path):
+    path = str(tmp_path / "captured.jsonl")
+    client = TestClient(capture.CaptureMiddleware(app, path=path))
+
+    response = client.get("/movies/44?unused=1")
+    assert response.status_code == 200
+    # writes out the queued records
+    capture.shutdown()
+
+    records = replay.load(path)
+    assert len(records) == 1
+    record = records[0]
+    assert record["method"] == "GET"
+    assert record["path"] == "/movies/44"
+    assert record["query"] == "unused=1"
+    assert record["body"] == ""
+    assert record["status"] == 200
+    assert record["latency_ms"] > 0
+    assert replay.route(record) == "GET /movies/{id}"
+
+
+def test_capture_large_body_not_recorded(tmp_path, monkeypatch):
+    monkeypatch.setattr(capture, "MAX_BODY_BYTES", 10)
+    path = str(tmp_path / "captured.jsonl")
+    client = TestClient(capture.CaptureMiddleware(app, path=path))
+
+    client.post("/movies/12346513245/conversations/", json={
+        "character_1_id": 0,
+        "character_2_id": 1,
+        "lines": [],
+    })
+    capture.shutdown()
+
+    with open(path, encoding="utf-8") as f:
+        record = json.loads(f.readline())
+    assert record["method"] == "POST"
+    assert record["body"] is None
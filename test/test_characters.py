@@ -1,6 +1,11 @@
+import threading
+
+import sqlalchemy
 from fastapi.testclient import TestClient
 
+from src.api import characters
 from src.api.server import app
+from src.similarity import SimilarityIndex, similarity_index
 
 import json
 
@@ -62,3 +67,60 @@ def test_sort_alphabetical_offset():
 def test_404():
     response = client.get("/characters/400")
     assert response.status_code == 404
+
+
+def test_similar_characters():
+    similarity_index.start_build()
+    assert similarity_index.wait_ready(60)
+
+    response = client.get("/characters/7421/similar?limit=5")
+    assert response.status_code == 200
+
+    similar = response.json()
+    assert len(similar) == 5
+    assert all(character["character_id"] != 7421 for character in similar)
+    scores = [character["similarity"] for character in similar]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_similar_characters_404():
+    similarity_index.start_build()
+    assert similarity_index.wait_ready(60)
+
+    response = client.get("/characters/400/similar")
+    assert response.status_code == 404
+
+
+def test_similar_during_refresh(monkeypatch):
+    similarity_index.start_build()
+    assert similarity_index.wait_ready(60)
+    before = similarity_index.similar(2)
+
+    started = threading.Event()
+    release = threading.Event()
+    compute_neighbours = SimilarityIndex._compute_neighbours
+
+    def slow_compute_neighbours(*args):
+        started.set()
+        release.wait()
+        compute_neighbours(*args)
+
+    monkeypatch.setattr(SimilarityIndex, "_compute_neighbours", staticmethod(slow_compute_neighbours))
+
+    # returns before the recompute, and lookups are served during it
+    similarity_index.refresh([2])
+    assert started.wait(60)
+    assert similarity_index.similar(2) == before
+
+    release.set()
+    assert similarity_index.wait_idle(60)
+    assert similarity_index.similar(2) == before
+
+
+def test_deadline_exceeded(monkeypatch):
+    # a statement that always outlives the deadline
+    monkeypatch.setattr(characters, "top_conversations_stmt", sqlalchemy.select(sqlalchemy.func.pg_sleep(1)))
+    monkeypatch.setenv("DEADLINE_GET_CHARACTER_MS", "100")
+    response = client.get("/characters/2")
+    assert response.status_code == 504
+    assert response.json()["deadline_ms"] == 100
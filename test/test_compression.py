@@ -0,0 +1,24 @@
+from fastapi.testclient import TestClient
+
+from src.api.server import app
+
+client = TestClient(app)
+
+
+def test_large_response_compressed():
+    response = client.get("/lines/?limit=250", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert len(response.json()) == 250
+
+
+def test_small_response_not_compressed():
+    response = client.get("/lines/49", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert "content-encoding" not in response.headers
+
+
+def test_identity():
+    response = client.get("/lines/?limit=250", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
@@ -1,6 +1,7 @@
 from fastapi.testclient import TestClient
 
 from src.api.server import app
+from src.similarity import similarity_index
 
 import json
 
@@ -31,6 +32,27 @@ def test_set_conversation():
     }
 
 
+def test_index_update_failure_keeps_conversation(monkeypatch):
+    def fail(character_ids):
+        raise RuntimeError("index update failed")
+
+    monkeypatch.setattr(similarity_index, "refresh", fail)
+    monkeypatch.setattr(similarity_index, "invalidate", lambda: None)
+    inputJson = {
+        "character_1_id": 0,
+        "character_2_id": 1,
+        "lines": [
+            {
+                "character_id": 0,
+                "line_text": "testing the api"
+            }
+        ]
+    }
+    response = client.post("/movies/0/conversations/", json=inputJson)
+    assert response.status_code == 200
+    assert client.get("/conversations/" + str(response.json())).status_code == 200
+
+
 def test_invalid_movie():
     inputJson = {
         "character_1_id": 0,
@@ -62,6 +84,23 @@ def test_invalid_character():
     assert response.status_code == 400
 
 
+def test_character_from_other_movie():
+    # character 49 exists, but in movie 3
+    inputJson = {
+        "character_1_id": 0,
+        "character_2_id": 49,
+        "lines": [
+            {
+                "character_id": 0,
+                "line_text": "testing the api"
+            }
+        ]
+    }
+
+    response = client.post("/movies/0/conversations/", json=inputJson)
+    assert response.status_code == 400
+
+
 def test_get_conversation():
     response = client.get("/conversations/25")
     assert response.status_code == 200
@@ -69,3 +108,32 @@ def test_get_conversation():
     with open("test/lines/conversation-25",
               encoding="utf-8") as f:
         assert response.json() == json.load(f)
+
+
+def test_get_conversation_paged():
+    with open("test/lines/conversation-25",
+              encoding="utf-8") as f:
+        expected = json.load(f)
+
+    lines = []
+    after = 0
+    while after is not None:
+        response = client.get(f"/conversations/25?limit=1&after={after}")
+        assert response.status_code == 200
+        lines += response.json()["lines"]
+        after = response.json()["next_cursor"]
+
+    assert lines == expected["lines"]
+
+
+def test_get_conversation_stream():
+    with open("test/lines/conversation-25",
+              encoding="utf-8") as f:
+        expected = json.load(f)
+
+    response = client.get("/conversations/25?stream=true")
+    assert response.status_code == 200
+
+    header, *lines = [json.loads(row) for row in response.text.splitlines()]
+    assert header["conversation_id"] == 25
+    assert [line["line"] for line in lines] == [line["line"] for line in expected["lines"]]
@@ -0,0 +1,45 @@
+from fastapi.testclient import TestClient
+
+from src.api.server import app
+
+client = TestClient(app)
+
+headers = {"Authorization": "Bearer test-token"}
+
+
+def test_disabled_without_token():
+    response = client.get("/diagnostics/runtime")
+    assert response.status_code == 404
+
+
+def test_wrong_token(monkeypatch):
+    monkeypatch.setenv("DIAGNOSTICS_TOKEN", "test-token")
+    response = client.get("/diagnostics/runtime", headers={"Authorization": "Bearer nope"})
+    assert response.status_code == 401
+
+
+def test_profile_next_requests(monkeypatch):
+    monkeypatch.setenv("DIAGNOSTICS_TOKEN", "test-token")
+    response = client.post("/diagnostics/profiles/?route=get_line&requests=2&interval_ms=1", headers=headers)
+    assert response.status_code == 201
+    id = response.json()["id"]
+
+    for _ in range(3):
+        assert client.get("/lines/49").status_code == 200
+
+    response = client.get(f"/diagnostics/profiles/{id}", headers=headers)
+    assert response.json()["completed"] == 2
+
+    # the route is back to normal, so it can be armed again
+    response = client.post("/diagnostics/profiles/?route=get_line&requests=1", headers=headers)
+    assert response.status_code == 201
+    assert client.delete(f"/diagnostics/profiles/{response.json()['id']}", headers=headers).status_code == 200
+
+
+def test_pyversion(monkeypatch):
+    assert client.get("/diagnostics/pyversion/").status_code == 404
+
+    monkeypatch.setenv("DIAGNOSTICS_TOKEN", "test-token")
+    assert client.get("/diagnostics/pyversion/").status_code == 401
+    response = client.get("/diagnostics/pyversion/", headers=headers)
+    assert response.status_code == 200
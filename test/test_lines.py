@@ -4,8 +4,10 @@ from src.api.server import app
 
 import json
 
+
 client = TestClient(app)
 
+
 def test_lines_movie_character_filter():
     response = client.get("/lines/?movie=watchmen&character=dr. manhattan")
     assert response.status_code == 200
@@ -15,6 +17,7 @@ def test_lines_movie_character_filter():
               ) as f:
         assert response.json() == json.load(f)
 
+
 def test_get_line():
     response = client.get("/lines/49")
     assert response.status_code == 200
@@ -22,6 +25,21 @@ def test_get_line():
     with open("test/lines/lines-49", encoding="utf-8") as f:
         assert response.json() == json.load(f)
 
+
 def test_404():
     response = client.get("/conversation/400")
     assert response.status_code == 404
+
+
+def test_get_line_fields():
+    response = client.get("/lines/49?fields=line,spoken_by")
+    assert response.status_code == 200
+
+    with open("test/lines/lines-49", encoding="utf-8") as f:
+        line = json.load(f)
+    assert response.json() == {"line": line["line"], "spoken_by": line["spoken_by"]}
+
+
+def test_unknown_field():
+    response = client.get("/lines/?fields=line,text")
+    assert response.status_code == 400
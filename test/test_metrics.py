@@ -0,0 +1,137 @@
+import asyncio
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+from src.admission import PriorityClass
+from src.api import characters
+from src.api.server import admission_classes, app
+from src.deadlines import RequestCancelled
+from src.singleflight import SingleFlight, flight
+
+client = TestClient(app)
+
+
+def test_coalescing_metrics():
+    before = client.get("/metrics/").json()["coalescing"]
+    client.get("/movies/44")
+    after = client.get("/metrics/").json()["coalescing"]
+
+    assert after["executed"] == before["executed"] + 1
+    assert after["in_flight"] == 0
+
+
+def test_admission_metrics():
+    response = client.get("/metrics/")
+    assert response.status_code == 200
+
+    admission = response.json()["admission"]
+    assert set(admission) == {"high", "normal", "low"}
+    assert admission["high"]["active"] == 1
+    assert all(c["shed"] == 0 for c in admission.values())
+
+
+def test_cancelled_waiter_leaves_queue():
+    async def run():
+        priority_class = PriorityClass("test", concurrency=1, queue_depth=1, queue_timeout=5, retry_after=1)
+        await priority_class.acquire()
+
+        waiter = asyncio.ensure_future(priority_class.acquire())
+        await asyncio.sleep(0)
+        assert priority_class.stats()["queued"] == 1
+
+        # a client disconnect cancels the queued request
+        waiter.cancel()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            pass
+        return priority_class.stats()
+
+    stats = asyncio.run(run())
+    assert stats["queued"] == 0
+    assert stats["active"] == 1
+
+
+def test_follower_reruns_after_leader_cancelled():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(None)
+        if len(calls) == 1:
+            started.set()
+            release.wait()
+            # the leader's client disconnected
+            raise RequestCancelled("get_movie")
+        return "result"
+
+    errors = []
+
+    def lead():
+        try:
+            flight.do("key", fetch)
+        except RequestCancelled as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=lead)
+    leader.start()
+    started.wait()
+
+    results = []
+    follower = threading.Thread(target=lambda: results.append(flight.do("key", fetch)))
+    follower.start()
+    while flight.stats()["coalesced"] == 0:
+        pass
+    release.set()
+    leader.join()
+    follower.join()
+
+    assert len(errors) == 1
+    assert results == ["result"]
+    assert len(calls) == 2
+
+
+def test_identical_requests_skip_admission(monkeypatch):
+    low = next(c for c in admission_classes if c.name == "low")
+    count = low.concurrency + low.queue_depth + 10
+
+    started = threading.Event()
+    release = threading.Event()
+    parse_fields = characters.parse_fields
+
+    def slow_parse_fields(*args):
+        started.set()
+        release.wait()
+        return parse_fields(*args)
+
+    monkeypatch.setattr(characters, "parse_fields", slow_parse_fields)
+
+    responses = []
+
+    def fetch():
+        responses.append(client.get("/characters/2"))
+
+    leader = threading.Thread(target=fetch)
+    leader.start()
+    started.wait()
+
+    before = flight.stats()["coalesced"]
+    followers = [threading.Thread(target=fetch) for _ in range(count - 1)]
+    for follower in followers:
+        follower.start()
+    # every follower has joined the running call before it is released
+    deadline = time.monotonic() + 10
+    while flight.stats()["coalesced"] < before + count - 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    leader.join()
+    for follower in followers:
+        follower.join()
+
+    assert [r.status_code for r in responses] == [200] * count
+    assert all(r.json() == responses[0].json() for r in responses)
+    assert low.stats()["active"] == 0
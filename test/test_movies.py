@@ -1,8 +1,12 @@
 from fastapi.testclient import TestClient
 
+from src import snapshot
 from src.api.server import app
 
 import json
+import os
+import shutil
+import time
 
 client = TestClient(app)
 
@@ -61,3 +65,57 @@ def test_sort_year_offset():
 def test_404():
     response = client.get("/movies/1")
     assert response.status_code == 404
+
+
+def test_movies_total_count():
+    response = client.get("/movies/?count=true&limit=250")
+    assert response.status_code == 200
+    assert response.headers["X-Total-Count-Exact"] == "true"
+    total = int(response.headers["X-Total-Count"])
+
+    last_page = client.get(f"/movies/?count=true&limit=250&offset={total - 1}")
+    assert len(last_page.json()) == 1
+    assert int(last_page.headers["X-Total-Count"]) == total
+
+
+def test_snapshot_rebuilt_after_write(monkeypatch, tmp_path):
+    path = str(tmp_path / "corpus.snapshot")
+    monkeypatch.setenv(snapshot.SNAPSHOT_ENV, path)
+    monkeypatch.setattr(snapshot, "REBUILD_DELAY", 0.1)
+    snapshot.write_snapshot(path)
+
+    before = client.get("/movies/0").json()["top_characters"][0]
+    other = 1 if before["character_id"] == 0 else 0
+    response = client.post("/movies/0/conversations/", json={
+        "character_1_id": before["character_id"],
+        "character_2_id": other,
+        "lines": [{"character_id": before["character_id"], "line_text": "testing the api"}],
+    })
+    assert response.status_code == 200
+
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        top = client.get("/movies/0").json()["top_characters"][0]
+        if top["num_lines"] == before["num_lines"] + 1:
+            break
+        time.sleep(0.1)
+    assert top["num_lines"] == before["num_lines"] + 1
+
+
+def test_snapshot_swap_drops_read_models(monkeypatch, tmp_path):
+    path = str(tmp_path / "corpus.snapshot")
+    monkeypatch.setenv(snapshot.SNAPSHOT_ENV, path)
+    snapshot.write_snapshot(path)
+    assert snapshot.current() is not None
+
+    dropped = []
+    for read_model in snapshot.READ_MODELS:
+        monkeypatch.setattr(read_model, "invalidate", lambda m=read_model: dropped.append(m))
+
+    # another worker swaps in a rebuilt snapshot
+    shutil.copy(path, path + ".other")
+    os.replace(path + ".other", path)
+    monkeypatch.setattr(snapshot, "_checked_at", 0.0)
+    snapshot.current()
+
+    assert dropped == list(snapshot.READ_MODELS)